@@ -0,0 +1,136 @@
+# MIT License
+#
+# Copyright(c) 2016-2017 Intel Corporation. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""Report the byte savings of VES request body compression
+
+The events are built the same way as VESPlugin builds them for a host with
+the given number of VMs, vCPUs, vNICs and disks per VM.
+
+    $ python compression_bench.py --vms 60 --batch-size 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'ves_plugin'))
+import fake_collectd
+fake_collectd.install()
+
+import ves_plugin
+
+
+def make_event(vm, args):
+    """Make measurement event of one VM with host values as additional fields"""
+    measurement = ves_plugin.MeasurementsForVfScaling(str(vm))
+    measurement.functional_role = 'Collectd VES Agent'
+    measurement.reporting_entity_id = 'compute-0.localdomain'
+    measurement.reporting_entity_name = measurement.reporting_entity_id
+    measurement.source_id = 'instance-{:08x}'.format(vm)
+    measurement.source_name = measurement.source_id
+    measurement.start_epoch_microsec = 1500000000.123456 * 1000000
+    measurement.measurement_interval = 10.0
+    mem_usage = ves_plugin.MemoryUsage(measurement.source_id)
+    mem_usage.memory_configured = 4194304.0
+    mem_usage.memory_free = 1048576.0 + vm
+    mem_usage.memory_buffered = mem_usage.memory_cached = 0
+    mem_usage.memory_slab_recl = mem_usage.memory_slab_unrecl = 0
+    measurement.add_memory_usage(mem_usage)
+    for cpu in range(args.vcpus):
+        cpu_usage = ves_plugin.CpuUsage(str(cpu))
+        cpu_usage.percent_usage = round(17.31 + cpu * 3.7 + vm, 2)
+        measurement.add_cpu_usage(cpu_usage)
+    for nic in range(args.vnics):
+        v_nic = ves_plugin.VNicPerformance('tap{:x}-{}'.format(vm, nic))
+        base = 1000003 * (vm + 1) + nic * 7919
+        v_nic.received_total_packets_accumulated = base
+        v_nic.transmitted_total_packets_accumulated = base // 2
+        v_nic.received_octets_accumulated = base * 1514
+        v_nic.transmitted_octets_accumulated = base * 733
+        v_nic.received_error_packets_accumulated = vm
+        v_nic.transmitted_error_packets_accumulated = 0
+        v_nic.received_discarded_packets_accumulated = nic
+        v_nic.transmitted_discarded_packets_accumulated = 0
+        measurement.add_v_nic_performance(v_nic)
+    for disk in range(args.disks):
+        disk_usage = ves_plugin.DiskUsage('vd{}'.format(chr(ord('a') + disk)))
+        base = 50021 * (vm + 1) + disk * 101
+        disk_usage.disk_octets_read_last = base * 4096
+        disk_usage.disk_octets_write_last = base * 2048
+        disk_usage.disk_ops_read_last = base
+        disk_usage.disk_ops_write_last = base // 2
+        measurement.add_disk_usage(disk_usage)
+    perf = ves_plugin.NamedArrayOfFields('perf')
+    for name in ('perf_cpu_cycles', 'perf_instructions', 'perf_cache_misses',
+                 'perf_cache_references', 'perf_branch_misses'):
+        perf.add(ves_plugin.Field(name, str(123456789 * (vm + 1))))
+    measurement.add_additional_measurement(perf)
+    for cpu in range(args.host_cpus):
+        for state in ('user', 'system', 'idle', 'wait', 'interrupt', 'softirq',
+                      'steal', 'nice'):
+            measurement.add_additional_fields(ves_plugin.Field(
+                'cpu-{}-percent-{}-value'.format(cpu, state), str(round(1.7 * cpu, 6))))
+    for state in ('used', 'free', 'buffered', 'cached', 'slab_recl', 'slab_unrecl'):
+        measurement.add_additional_fields(ves_plugin.Field(
+            'memory-memory-{}-value'.format(state), str(1.3e10)))
+    return measurement
+
+
+def report(name, bodies, compress):
+    """Print raw and compressed size and compression time of the bodies"""
+    raw = sum(len(body) for body in bodies)
+    start = time.time()
+    compressed = sum(len(compress(body)) for body in bodies)
+    elapsed = time.time() - start
+    print('{:<28} {:>6} requests {:>11} B raw {:>10} B compressed '
+          '{:>6.1f}% saved {:>8.3f} ms/request'.format(
+              name, len(bodies), raw, compressed, 100.0 * (raw - compressed) / raw,
+              1000.0 * elapsed / len(bodies)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vms', type=int, default=60)
+    parser.add_argument('--vcpus', type=int, default=4)
+    parser.add_argument('--vnics', type=int, default=2)
+    parser.add_argument('--disks', type=int, default=2)
+    parser.add_argument('--host-cpus', type=int, default=16,
+                        help='host CPUs reported in additional fields')
+    parser.add_argument('--batch-size', type=int, default=20)
+    args = parser.parse_args()
+
+    events = [make_event(vm, args) for vm in range(args.vms)]
+    single = [event.get_json() for event in events]
+    batches = []
+    for index in range(0, len(events), args.batch_size):
+        batches.append(b'{"eventList": [' + b','.join(
+            event.encode() for event in events[index:index + args.batch_size]) + b']}')
+    for encoding in sorted(ves_plugin.compressors):
+        compress = ves_plugin.compressors[encoding]
+        report('{} single events'.format(encoding), single, compress)
+        report('{} batches of {}'.format(encoding, args.batch_size), batches, compress)
+
+
+if __name__ == '__main__':
+    main()
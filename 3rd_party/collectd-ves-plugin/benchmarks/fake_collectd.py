@@ -0,0 +1,176 @@
+# MIT License
+#
+# Copyright(c) 2016-2017 Intel Corporation. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Stand-in of the collectd python module for running ves_plugin outside of
+collectd. The registered callbacks are kept in `callbacks`, dispatched values
+are passed to the write callbacks like collectd does.
+
+    import fake_collectd
+    fake_collectd.install()
+    import ves_plugin
+"""
+
+import sys
+import time
+
+DS_TYPE_COUNTER = 0
+DS_TYPE_GAUGE = 1
+DS_TYPE_DERIVE = 2
+DS_TYPE_ABSOLUTE = 3
+
+NOTIF_FAILURE = 1
+NOTIF_WARNING = 2
+NOTIF_OKAY = 4
+
+# data sources (name, type, min, max) of the types used by the benchmarks,
+# as defined in collectd types.db
+DATASETS = {
+    'cpu' : [('value', DS_TYPE_DERIVE, 0, None)],
+    'derive' : [('value', DS_TYPE_DERIVE, 0, None)],
+    'disk_octets' : [('read', DS_TYPE_DERIVE, 0, None), ('write', DS_TYPE_DERIVE, 0, None)],
+    'disk_ops' : [('read', DS_TYPE_DERIVE, 0, None), ('write', DS_TYPE_DERIVE, 0, None)],
+    'disk_time' : [('read', DS_TYPE_DERIVE, 0, None), ('write', DS_TYPE_DERIVE, 0, None)],
+    'duration' : [('seconds', DS_TYPE_GAUGE, 0, None)],
+    'gauge' : [('value', DS_TYPE_GAUGE, None, None)],
+    'if_dropped' : [('rx', DS_TYPE_DERIVE, 0, None), ('tx', DS_TYPE_DERIVE, 0, None)],
+    'if_errors' : [('rx', DS_TYPE_DERIVE, 0, None), ('tx', DS_TYPE_DERIVE, 0, None)],
+    'if_octets' : [('rx', DS_TYPE_DERIVE, 0, None), ('tx', DS_TYPE_DERIVE, 0, None)],
+    'if_packets' : [('rx', DS_TYPE_DERIVE, 0, None), ('tx', DS_TYPE_DERIVE, 0, None)],
+    'memory' : [('value', DS_TYPE_GAUGE, 0, None)],
+    'percent' : [('value', DS_TYPE_GAUGE, 0, 100.1)],
+    'perf' : [('value', DS_TYPE_DERIVE, 0, None)],
+    'queue_length' : [('value', DS_TYPE_GAUGE, 0, None)],
+    'total_bytes' : [('value', DS_TYPE_DERIVE, 0, None)],
+    'virt_cpu_total' : [('value', DS_TYPE_DERIVE, 0, None)],
+    'virt_vcpu' : [('value', DS_TYPE_DERIVE, 0, None)]
+}
+
+callbacks = {
+    'config' : [],
+    'init' : [],
+    'read' : [],
+    'write' : [],
+    'notification' : [],
+    'shutdown' : []
+}
+
+# log messages (level, message) and the minimal level printed to stderr
+log = []
+LOG_LEVELS = ('debug', 'info', 'notice', 'warning', 'error')
+verbosity = 'warning'
+
+
+class Config(object):
+    """Configuration block"""
+    def __init__(self, key, values, children=()):
+        self.key = key
+        self.values = values
+        self.children = list(children)
+
+
+class Values(object):
+    """Value list"""
+    def __init__(self, **kwargs):
+        self.host = 'localhost'
+        self.plugin = ''
+        self.plugin_instance = ''
+        self.type = ''
+        self.type_instance = ''
+        self.time = 0
+        self.interval = 10.0
+        self.values = []
+        self.meta = None
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def dispatch(self, **kwargs):
+        """Pass the values to all write callbacks"""
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+        if not self.time:
+            self.time = time.time()
+        for callback in list(callbacks['write']):
+            callback(self)
+
+
+class Notification(object):
+    """Notification"""
+    def __init__(self, **kwargs):
+        self.host = 'localhost'
+        self.plugin = ''
+        self.plugin_instance = ''
+        self.type = ''
+        self.type_instance = ''
+        self.time = time.time()
+        self.severity = NOTIF_WARNING
+        self.message = ''
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def dispatch(self):
+        """Pass the notification to all notification callbacks"""
+        for callback in list(callbacks['notification']):
+            callback(self)
+
+
+def get_dataset(type_name):
+    """Get data sources of the type"""
+    try:
+        return DATASETS[type_name]
+    except KeyError:
+        raise TypeError('Dataset {} not found'.format(type_name))
+
+
+def _register(kind):
+    def register(callback, *args, **kwargs):
+        callbacks[kind].append(callback)
+    return register
+
+
+def _unregister(kind):
+    def unregister(callback):
+        callbacks[kind][:] = [x for x in callbacks[kind] if x != callback]
+    return unregister
+
+
+def _logger(level):
+    def logger(message):
+        log.append((level, message))
+        if LOG_LEVELS.index(level) >= LOG_LEVELS.index(verbosity):
+            sys.stderr.write('[{}] {}\n'.format(level, message))
+    return logger
+
+
+for _kind in callbacks:
+    globals()['register_' + _kind] = _register(_kind)
+    globals()['unregister_' + _kind] = _unregister(_kind)
+for _level in LOG_LEVELS:
+    globals()[_level] = _logger(_level)
+
+
+def install():
+    """Make this module importable as collectd unless the real one is"""
+    try:
+        import collectd
+    except ImportError:
+        sys.modules['collectd'] = sys.modules[__name__]
@@ -0,0 +1,317 @@
+# MIT License
+#
+# Copyright(c) 2016-2017 Intel Corporation. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Measure ves_plugin throughput outside of collectd
+
+The plugin is fed with the values collectd virt, cpu and memory plugins write
+for a host with the given number of VMs, vCPUs, vNICs and disks per VM, and
+sends the events to a local stand-in of Vendor Event Listener. Reported are
+write callback throughput, event build time per SendEventInterval tick, end
+to end event throughput, bytes on the wire and memory used by the plugin.
+
+    $ python throughput_bench.py --vms 200 --ticks 10 --set BatchSize=20
+
+The results can be saved and used as a baseline of later runs, which then
+fail if any result is worse than the baseline by more than the tolerance:
+
+    $ python throughput_bench.py --save baseline.json
+    $ python throughput_bench.py --baseline baseline.json --tolerance 0.15
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'ves_plugin'))
+import fake_collectd
+fake_collectd.install()
+
+import collectd
+import ves_plugin
+from ves_listener import VESListener
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HOST = 'compute-0.localdomain'
+INTERVAL = 10.0
+DELIVERY_TIMEOUT = 60.0
+
+# results compared with the baseline, True if higher is better
+RESULTS = (
+    ('writes_per_sec', True),
+    ('build_ms', False),
+    ('events_per_sec', True),
+    ('bytes_per_event', False),
+    ('memory_bytes', False)
+)
+# arguments which define the workload
+WORKLOAD = ('vms', 'vcpus', 'vnics', 'disks', 'host_cpus', 'ticks', 'set')
+# plugin options the benchmark cannot drive: it runs the timer ticks itself
+# in this process and expects their events to be sent right away
+UNSUPPORTED_OPTIONS = ('SendEventInterval', 'Pacing', 'HelperProcess')
+
+
+def make_values(tick, args):
+    """Make the values written by collectd in one interval"""
+    now = 1500000000.0 + tick * INTERVAL
+    values = []
+    def add(plugin, plugin_instance, type_name, type_instance, *vals):
+        values.append(collectd.Values(
+            host=HOST, plugin=plugin, plugin_instance=plugin_instance,
+            type=type_name, type_instance=type_instance, time=now,
+            interval=INTERVAL, values=list(vals)))
+    for vm in range(args.vms):
+        name = 'instance-{:08x}'.format(vm)
+        add('virt', name, 'virt_cpu_total', '', int(now * 1e9 * 0.3 * args.vcpus))
+        for cpu in range(args.vcpus):
+            add('virt', name, 'virt_vcpu', str(cpu), int(now * 1e9 * 0.3))
+        add('virt', name, 'memory', 'total', 4294967296)
+        add('virt', name, 'memory', 'unused', 1073741824 + vm)
+        add('virt', name, 'memory', 'rss', 2147483648)
+        for nic in range(args.vnics):
+            nic_name = 'tap{:x}-{}'.format(vm, nic)
+            packets = int(now * 1000) * (nic + 1)
+            add('virt', name, 'if_packets', nic_name, packets, packets // 2)
+            add('virt', name, 'if_octets', nic_name, packets * 1514, packets * 733)
+            add('virt', name, 'if_errors', nic_name, vm, 0)
+            add('virt', name, 'if_dropped', nic_name, nic, 0)
+        for disk in range(args.disks):
+            disk_name = 'vd{}'.format(chr(ord('a') + disk))
+            ops = int(now * 100) * (disk + 1)
+            add('virt', name, 'disk_octets', disk_name, ops * 4096, ops * 2048)
+            add('virt', name, 'disk_ops', disk_name, ops, ops // 2)
+        for counter in ('perf_cpu_cycles', 'perf_instructions', 'perf_cache_misses'):
+            add('virt', name, 'perf', counter, int(now * 1e6) * (vm + 1))
+    for cpu in range(args.host_cpus):
+        for state in ('user', 'system', 'idle', 'wait', 'interrupt', 'softirq',
+                      'steal', 'nice'):
+            add('cpu', str(cpu), 'percent', state, 12.5)
+    for state in ('used', 'free', 'buffered', 'cached', 'slab_recl', 'slab_unrecl'):
+        add('memory', '', 'memory', state, 1.3e10)
+    return values
+
+
+def parse_option(option):
+    """Parse KEY=VALUE plugin configuration option, the value type is the one
+    of collectd config: bool, number or string"""
+    key, _, value = option.partition('=')
+    if value.lower() in ('true', 'false'):
+        return key, value.lower() == 'true'
+    try:
+        return key, float(value)
+    except ValueError:
+        return key, value
+
+
+def events_per_tick(args):
+    """Number of events the plugin sends per tick: one per VM and one of the
+    host if SendHostEvent is set"""
+    options = dict(parse_option(option) for option in args.set)
+    return args.vms + (1 if options.get('SendHostEvent') is True else 0)
+
+
+def start_plugin(args, listener):
+    """Configure and initialize a plugin instance sending to the listener"""
+    options = [('Domain', '127.0.0.1'), ('Port', float(listener.port)),
+               # the timer ticks are driven by the benchmark
+               ('SendEventInterval', 86400.0)]
+    options.extend(parse_option(option) for option in args.set)
+    plugin = ves_plugin.VESPlugin()
+    plugin.config(collectd.Config('Module', ['ves_plugin'], [
+        collectd.Config(key, [value]) for key, value in options]))
+    plugin.init()
+    plugin.write(collectd.Values(host=HOST, plugin='ves_plugin', type='gauge',
+                                 values=[0]))
+    return plugin
+
+
+def run_tick(plugin, values):
+    """Write the values and run the timer tick, return the write and build
+    time"""
+    write = plugin.write
+    start = time.time()
+    for vl in values:
+        write(vl)
+    written = time.time()
+    plugin.event_timer()
+    return written - start, time.time() - written
+
+
+def measure_throughput(args, listener):
+    """Run the ticks and return the throughput results"""
+    plugin = start_plugin(args, listener)
+    # the first tick creates the cache entries and has no deltas to report
+    run_tick(plugin, make_values(0, args))
+    if not listener.wait(events_per_tick(args), DELIVERY_TIMEOUT):
+        plugin.shutdown()
+        sys.exit('warm-up events were not delivered in {:.0f} s'.format(
+            DELIVERY_TIMEOUT))
+    events, wire_bytes = listener.events, listener.bytes
+    write_rates = []
+    build_times = []
+    elapsed = 0.0
+    for tick in range(1, args.ticks + 1):
+        values = make_values(tick, args)
+        gc.collect()
+        start = time.time()
+        tick_write, tick_build = run_tick(plugin, values)
+        elapsed += time.time() - start
+        write_rates.append(len(values) / tick_write)
+        build_times.append(tick_build)
+    start = time.time()
+    delivered = listener.wait(events + events_per_tick(args) * args.ticks,
+                              DELIVERY_TIMEOUT)
+    elapsed += time.time() - start
+    plugin.shutdown()
+    if not delivered:
+        sys.exit('not all events were delivered in {:.0f} s'.format(
+            DELIVERY_TIMEOUT))
+    events = listener.events - events
+    # medians are less affected by the noise of other processes
+    write_rates.sort()
+    build_times.sort()
+    return {
+        'writes_per_sec' : write_rates[len(write_rates) // 2],
+        'build_ms' : 1000.0 * build_times[len(build_times) // 2],
+        'build_max_ms' : 1000.0 * build_times[-1],
+        'events_per_sec' : events / elapsed,
+        'bytes' : listener.bytes - wire_bytes,
+        'bytes_per_event' : float(listener.bytes - wire_bytes) / max(events, 1)
+    }
+
+
+def measure_memory(args, listener):
+    """Return memory allocated by a plugin instance holding the values of the
+    host, None if it cannot be measured"""
+    if tracemalloc is None:
+        return None
+    values = [make_values(tick, args) for tick in range(2)]
+    gc.collect()
+    plugin = None
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        plugin = start_plugin(args, listener)
+        events = listener.events
+        run_tick(plugin, values[0])
+        # the values written in the next interval are held by the plugin
+        # until the timer tick, so it is measured while they are held
+        write = plugin.write
+        for vl in values[1]:
+            write(vl)
+        # the values are referenced by the plugin cache in collectd too
+        del values
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        plugin.event_timer()
+        delivered = listener.wait(events + 2 * events_per_tick(args), DELIVERY_TIMEOUT)
+    finally:
+        tracemalloc.stop()
+        if plugin is not None:
+            plugin.shutdown()
+    if not delivered:
+        sys.exit('not all events were delivered in {:.0f} s'.format(
+            DELIVERY_TIMEOUT))
+    return memory
+
+
+def compare(results, baseline, tolerance):
+    """Print the results compared with the baseline, return the names of the
+    regressed results"""
+    regressions = []
+    for name, higher_is_better in RESULTS:
+        if results.get(name) is None or baseline.get(name) is None:
+            continue
+        change = (results[name] - baseline[name]) / float(baseline[name] or 1)
+        regressed = -change > tolerance if higher_is_better else change > tolerance
+        print('{:<16} {:>14.2f} baseline {:>14.2f} {:>+7.1f}%{}'.format(
+            name, results[name], baseline[name], 100.0 * change,
+            ' REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vms', type=int, default=100)
+    parser.add_argument('--vcpus', type=int, default=4)
+    parser.add_argument('--vnics', type=int, default=2)
+    parser.add_argument('--disks', type=int, default=2)
+    parser.add_argument('--host-cpus', type=int, default=16)
+    parser.add_argument('--ticks', type=int, default=5,
+                        help='measured SendEventInterval ticks')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='plugin configuration option, can be repeated')
+    parser.add_argument('--save', metavar='FILE', help='save the results')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare the results with the saved ones')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='relative change of a result considered a regression')
+    args = parser.parse_args()
+    for option in args.set:
+        key = parse_option(option)[0]
+        if key in UNSUPPORTED_OPTIONS:
+            parser.error('option {} is not supported by the benchmark'.format(key))
+
+    listener = VESListener()
+    listener.start()
+    try:
+        results = measure_throughput(args, listener)
+        results['memory_bytes'] = measure_memory(args, listener)
+    finally:
+        listener.stop()
+    memory = results['memory_bytes']
+    print('writes          {:>14.0f} /s'.format(results['writes_per_sec']))
+    print('build           {:>14.3f} ms/tick (max {:.3f})'.format(
+        results['build_ms'], results['build_max_ms']))
+    print('events          {:>14.0f} /s'.format(results['events_per_sec']))
+    print('bytes           {:>14} ({:.0f} B/event)'.format(
+        results['bytes'], results['bytes_per_event']))
+    print('memory          {:>14} B'.format('n/a' if memory is None else memory))
+
+    workload = dict((name, getattr(args, name)) for name in WORKLOAD)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'workload' : workload, 'results' : results}, f,
+                      indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['workload'] != workload:
+            sys.exit('the workload differs from the baseline: {}'.format(
+                baseline['workload']))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            sys.exit('regressed: {}'.format(', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
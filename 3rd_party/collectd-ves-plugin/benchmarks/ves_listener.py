@@ -0,0 +1,113 @@
+# MIT License
+#
+# Copyright(c) 2016-2017 Intel Corporation. All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+"""Stand-in of Vendor Event Listener which accepts all events and counts
+requests, events and the bytes received"""
+
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.listener.received(body, self.headers.get('Content-Encoding'))
+        self.send_response(self.server.listener.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class VESListener(object):
+    """Local HTTP listener counting the received events"""
+
+    def __init__(self, host='127.0.0.1', port=0, status=202):
+        self.status = status
+        self.requests = 0
+        self.events = 0
+        # bytes of the request bodies as sent and after decompression
+        self.bytes = 0
+        self.raw_bytes = 0
+        self.__cond = threading.Condition()
+        self.__server = _Server((host, port), _Handler)
+        self.__server.listener = self
+        self.__thread = None
+
+    @property
+    def port(self):
+        return self.__server.server_address[1]
+
+    def received(self, body, encoding=None):
+        """Count the request body"""
+        wire_bytes = len(body)
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        events = body.count(b'"commonEventHeader"')
+        with self.__cond:
+            self.requests += 1
+            self.events += events
+            self.bytes += wire_bytes
+            self.raw_bytes += len(body)
+            self.__cond.notify_all()
+
+    def wait(self, events, timeout):
+        """Wait until the number of received events reaches the given one,
+        return False on timeout"""
+        deadline = time.time() + timeout
+        with self.__cond:
+            while self.events < events:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.__cond.wait(remaining)
+        return True
+
+    def start(self):
+        """Start serving in a background thread"""
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         name='ves_listener')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -20,20 +20,87 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
-import collectd
+try:
+    import collectd
+except ImportError:
+    # the helper process runs outside of collectd, see helper_main()
+    collectd = None
 import json
 import sys
 import base64
 try:
     # For Python 3.0 and later
-    import urllib.request as url
+    import http.client as httplib
 except ImportError:
-    # Fall back to Python 2's urllib2
-    import urllib2 as url
+    # Fall back to Python 2's httplib
+    import httplib
 import socket
 import time
-from threading import Timer
+import os
+import struct
+import zlib
+import itertools
+import heapq
+import bisect
+import math
+import random
+import re
+import email.utils
+import hashlib
+import functools
+import subprocess
+import traceback
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import fnmatch
+from array import array
+from collections import deque
+from collections import namedtuple
+try:
+    from sys import intern
+except ImportError:
+    # Python 2 builtin
+    pass
+try:
+    # Python 2 has long integers too
+    INTEGER_TYPES = (int, long)
+except NameError:
+    INTEGER_TYPES = (int,)
+from threading import Event as ThreadEvent
 from threading import Lock
+from threading import Condition
+from threading import Thread
+
+def json_dumps(obj):
+    """Encode the object to JSON bytes by the standard json module"""
+    return json.dumps(obj).encode()
+
+def gzip_compress(data):
+    """Compress the data to gzip format"""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+# HTTP content encodings of compressed request bodies
+compressors = {
+    'gzip' : gzip_compress,
+    'deflate' : zlib.compress
+}
+
+# available JSON encoders by name, the faster ones are optional
+json_encoders = {'json' : json_dumps}
+try:
+    import orjson
+    json_encoders['orjson'] = orjson.dumps
+except ImportError:
+    pass
+try:
+    import ujson
+    json_encoders['ujson'] = lambda obj: ujson.dumps(obj).encode()
+except ImportError:
+    pass
 
 class Event(object):
     """Event header"""
@@ -57,9 +124,10 @@ class Event(object):
         self.internal_header_fields = {}
         self.nfc_naming_code = ""
         self.nf_naming_code = ""
+        self.__json = None
 
-    def get_json(self):
-        """Get the object of the datatype"""
+    def get_event(self):
+        """Get the object of the event (header and datatype fields)"""
         obj = {}
         obj['version'] = self.version
         obj['eventType'] = self.event_type
@@ -77,12 +145,20 @@ class Event(object):
         obj['internalHeaderFields'] = self.internal_header_fields
         obj['nfcNamingCode'] = self.nfc_naming_code
         obj['nfNamingCode'] = self.nf_naming_code
-        return json.dumps({
-            'event' : {
-                'commonEventHeader' : obj,
-                self.get_name() : self.get_obj()
-            }
-        }).encode()
+        return {
+            'commonEventHeader' : obj,
+            self.get_name() : self.get_obj()
+        }
+
+    def encode(self, dumps=json_dumps):
+        """Get the JSON encoded event object, the event is encoded only once"""
+        if self.__json is None:
+            self.__json = dumps(self.get_event())
+        return self.__json
+
+    def get_json(self, dumps=json_dumps):
+        """Get the JSON encoded single event request body"""
+        return b'{"event": ' + self.encode(dumps) + b'}'
 
     def get_name():
         assert False, 'abstract method get_name() is not implemented'
@@ -119,222 +195,90 @@ class NamedArrayOfFields(object):
             'arrayOfFields' : self.array_of_fields
         }
 
+def ves_field_name(attr):
+    """Get VES field name (camel case) of the datatype attribute"""
+    words = attr.split('_')
+    return words[0] + ''.join(word.capitalize() for word in words[1:])
+
+def ves_attributes(*parts):
+    """Make attribute names by joining each combination of the name parts"""
+    return tuple('_'.join(names) for names in itertools.product(*parts))
+
+def ves_datatype(identifier, required=(), computed={}, defaults={}):
+    """Class decorator generating __init__() and get_obj() of VES datatype
+
+    Attributes of the datatype are taken from __slots__ of the class. The
+    required ones are always set in the object (the computed ones by calling
+    the given method), the optional ones only if they are not None. The
+    generated get_obj() has no loop, each field is checked by its own line.
+    """
+    def decorate(cls):
+        optional = [attr for attr in cls.__slots__ if attr not in required]
+        source = ['def __init__(self, identifier):',
+                  '    """Construct the datatype with all optional fields unset"""',
+                  '    self.{} = identifier'.format(identifier)]
+        source += ['    self.{} = {!r}'.format(attr, defaults.get(attr)) for attr in
+                   cls.__slots__ if attr != identifier and attr not in defaults]
+        source += ['    self.{} = {!r}'.format(attr, defaults[attr]) for attr in defaults]
+        source += ['def get_obj(self):',
+                   '    """Get the object of the datatype"""',
+                   '    obj = {']
+        source += ['        {!r} : self.{},'.format(ves_field_name(attr),
+                   '{}()'.format(computed[attr]) if attr in computed else attr)
+                   for attr in required]
+        source += ['    }']
+        for attr in optional:
+            source += ['    if self.{} is not None:'.format(attr),
+                       '        obj[{!r}] = self.{}'.format(ves_field_name(attr), attr)]
+        source += ['    return obj']
+        namespace = {}
+        exec('\n'.join(source), namespace)
+        cls.__init__ = namespace['__init__']
+        cls.get_obj = namespace['get_obj']
+        return cls
+    return decorate
+
 class VESDataType(object):
     """ Base VES datatype """
 
-    def set_optional(self, obj, key, val):
-        if val is not None:
-            obj[key] = val
+    __slots__ = ()
 
+@ves_datatype('disk_identifier', required=('disk_identifier',))
 class DiskUsage(VESDataType):
     """diskUsage datatype"""
 
-    def __init__(self, identifier):
-      self.disk_identifier = identifier
-      self.disk_io_time_avg = None
-      self.disk_io_time_last = None
-      self.disk_io_time_max = None
-      self.disk_io_time_min = None
-      self.disk_merged_read_avg = None
-      self.disk_merged_read_last = None
-      self.disk_merged_read_max = None
-      self.disk_merged_read_min = None
-      self.disk_merged_write_avg = None
-      self.disk_merged_write_last = None
-      self.disk_merged_write_max = None
-      self.disk_merged_write_min = None
-      self.disk_octets_read_avg = None
-      self.disk_octets_read_last = None
-      self.disk_octets_read_max = None
-      self.disk_octets_read_min = None
-      self.disk_octets_write_avg = None
-      self.disk_octets_write_last = None
-      self.disk_octets_write_max = None
-      self.disk_octets_write_min = None
-      self.disk_ops_read_avg = None
-      self.disk_ops_read_last = None
-      self.disk_ops_read_max = None
-      self.disk_ops_read_min = None
-      self.disk_ops_write_avg = None
-      self.disk_ops_write_last = None
-      self.disk_ops_write_max = None
-      self.disk_ops_write_min = None
-      self.disk_pending_operations_avg = None
-      self.disk_pending_operations_last = None
-      self.disk_pending_operations_max = None
-      self.disk_pending_operations_min = None
-      self.disk_time_read_avg = None
-      self.disk_time_read_last = None
-      self.disk_time_read_max = None
-      self.disk_time_read_min = None
-      self.disk_time_write_avg = None
-      self.disk_time_write_last = None
-      self.disk_time_write_max = None
-      self.disk_time_write_min = None
-
-    def get_obj(self):
-        obj = {
-            # required
-            'diskIdentifier' : self.disk_identifier
-        }
-        self.set_optional(obj, 'diskIoTimeAvg', self.disk_io_time_avg)
-        self.set_optional(obj, 'diskIoTimeLast', self.disk_io_time_last)
-        self.set_optional(obj, 'diskIoTimeMax', self.disk_io_time_max)
-        self.set_optional(obj, 'diskIoTimeMin', self.disk_io_time_min)
-        self.set_optional(obj, 'diskMergedReadAvg', self.disk_merged_read_avg)
-        self.set_optional(obj, 'diskMergedReadLast', self.disk_merged_read_last)
-        self.set_optional(obj, 'diskMergedReadMax', self.disk_merged_read_max)
-        self.set_optional(obj, 'diskMergedReadMin', self.disk_merged_read_min)
-        self.set_optional(obj, 'diskMergedWriteAvg', self.disk_merged_write_avg)
-        self.set_optional(obj, 'diskMergedWriteLast', self.disk_merged_write_last)
-        self.set_optional(obj, 'diskMergedWriteMax', self.disk_merged_write_max)
-        self.set_optional(obj, 'diskMergedWriteMin', self.disk_merged_write_min)
-        self.set_optional(obj, 'diskOctetsReadAvg', self.disk_octets_read_avg)
-        self.set_optional(obj, 'diskOctetsReadLast', self.disk_octets_read_last)
-        self.set_optional(obj, 'diskOctetsReadMax', self.disk_octets_read_max)
-        self.set_optional(obj, 'diskOctetsReadMin', self.disk_octets_read_min)
-        self.set_optional(obj, 'diskOctetsWriteAvg', self.disk_octets_write_avg)
-        self.set_optional(obj, 'diskOctetsWriteLast', self.disk_octets_write_last)
-        self.set_optional(obj, 'diskOctetsWriteMax', self.disk_octets_write_max)
-        self.set_optional(obj, 'diskOctetsWriteMin', self.disk_octets_write_min)
-        self.set_optional(obj, 'diskOpsReadAvg', self.disk_ops_read_avg)
-        self.set_optional(obj, 'diskOpsReadLast', self.disk_ops_read_last)
-        self.set_optional(obj, 'diskOpsReadMax', self.disk_ops_read_max)
-        self.set_optional(obj, 'diskOpsReadMin', self.disk_ops_read_min)
-        self.set_optional(obj, 'diskOpsWriteAvg', self.disk_ops_write_avg)
-        self.set_optional(obj, 'diskOpsWriteLast', self.disk_ops_write_last)
-        self.set_optional(obj, 'diskOpsWriteMax', self.disk_ops_write_max)
-        self.set_optional(obj, 'diskOpsWriteMin', self.disk_ops_write_min)
-        self.set_optional(obj, 'diskPendingOperationsAvg', self.disk_pending_operations_avg)
-        self.set_optional(obj, 'diskPendingOperationsLast', self.disk_pending_operations_last)
-        self.set_optional(obj, 'diskPendingOperationsMax', self.disk_pending_operations_max)
-        self.set_optional(obj, 'diskPendingOperationsMin', self.disk_pending_operations_min)
-        self.set_optional(obj, 'diskTimeReadAvg', self.disk_time_read_avg)
-        self.set_optional(obj, 'diskTimeReadLast', self.disk_time_read_last)
-        self.set_optional(obj, 'diskTimeReadMax', self.disk_time_read_max)
-        self.set_optional(obj, 'diskTimeReadMin', self.disk_time_read_min)
-        self.set_optional(obj, 'diskTimeWriteAvg', self.disk_time_write_avg)
-        self.set_optional(obj, 'diskTimeWriteLast', self.disk_time_write_last)
-        self.set_optional(obj, 'diskTimeWriteMax', self.disk_time_write_max)
-        self.set_optional(obj, 'diskTimeWriteMin', self.disk_time_write_min)
-        return obj
+    __slots__ = ('disk_identifier',) + ves_attributes(('disk',), ('io_time',
+        'merged_read', 'merged_write', 'octets_read', 'octets_write', 'ops_read',
+        'ops_write', 'pending_operations', 'time_read', 'time_write'),
+        ('avg', 'last', 'max', 'min'))
 
+@ves_datatype('v_nic_identifier', required=('values_are_suspect', 'v_nic_identifier'),
+              defaults={'values_are_suspect' : 'true'})
 class VNicPerformance(VESDataType):
     """vNicPerformance datatype"""
 
-    def __init__(self, identifier):
-      self.received_broadcast_packets_accumulated = None
-      self.received_broadcast_packets_delta = None
-      self.received_discarded_packets_accumulated = None
-      self.received_discarded_packets_delta = None
-      self.received_error_packets_accumulated = None
-      self.received_error_packets_delta = None
-      self.received_multicast_packets_accumulated = None
-      self.received_multicast_packets_delta = None
-      self.received_octets_accumulated = None
-      self.received_octets_delta = None
-      self.received_total_packets_accumulated = None
-      self.received_total_packets_delta = None
-      self.received_unicast_packets_accumulated = None
-      self.received_unicast_packets_delta = None
-      self.transmitted_broadcast_packets_accumulated = None
-      self.transmitted_broadcast_packets_delta = None
-      self.transmitted_discarded_packets_accumulated = None
-      self.transmitted_discarded_packets_delta = None
-      self.transmitted_error_packets_accumulated = None
-      self.transmitted_error_packets_delta = None
-      self.transmitted_multicast_packets_accumulated = None
-      self.transmitted_multicast_packets_delta = None
-      self.transmitted_octets_accumulated = None
-      self.transmitted_octets_delta = None
-      self.transmitted_total_packets_accumulated = None
-      self.transmitted_total_packets_delta = None
-      self.transmitted_unicast_packets_accumulated = None
-      self.transmitted_unicast_packets_delta = None
-      self.values_are_suspect = 'true'
-      self.v_nic_identifier = identifier
-
-    def get_obj(self):
-        obj = {
-            # required
-            'valuesAreSuspect' : self.values_are_suspect,
-            'vNicIdentifier' : self.v_nic_identifier
-        }
-        # optional
-        self.set_optional(obj, 'receivedBroadcastPacketsAccumulated', self.received_broadcast_packets_accumulated)
-        self.set_optional(obj, 'receivedBroadcastPacketsDelta', self.received_broadcast_packets_delta)
-        self.set_optional(obj, 'receivedDiscardedPacketsAccumulated', self.received_discarded_packets_accumulated)
-        self.set_optional(obj, 'receivedDiscardedPacketsDelta', self.received_discarded_packets_delta)
-        self.set_optional(obj, 'receivedErrorPacketsAccumulated', self.received_error_packets_accumulated)
-        self.set_optional(obj, 'receivedErrorPacketsDelta', self.received_error_packets_delta)
-        self.set_optional(obj, 'receivedMulticastPacketsAccumulated', self.received_multicast_packets_accumulated)
-        self.set_optional(obj, 'receivedMulticastPacketsDelta', self.received_multicast_packets_delta)
-        self.set_optional(obj, 'receivedOctetsAccumulated', self.received_octets_accumulated)
-        self.set_optional(obj, 'receivedOctetsDelta', self.received_octets_delta)
-        self.set_optional(obj, 'receivedTotalPacketsAccumulated', self.received_total_packets_accumulated)
-        self.set_optional(obj, 'receivedTotalPacketsDelta', self.received_total_packets_delta)
-        self.set_optional(obj, 'receivedUnicastPacketsAccumulated', self.received_unicast_packets_accumulated)
-        self.set_optional(obj, 'receivedUnicastPacketsDelta', self.received_unicast_packets_delta)
-        self.set_optional(obj, 'transmittedBroadcastPacketsAccumulated', self.transmitted_broadcast_packets_accumulated)
-        self.set_optional(obj, 'transmittedBroadcastPacketsDelta', self.transmitted_broadcast_packets_delta)
-        self.set_optional(obj, 'transmittedDiscardedPacketsAccumulated', self.transmitted_discarded_packets_accumulated)
-        self.set_optional(obj, 'transmittedDiscardedPacketsDelta', self.transmitted_discarded_packets_delta)
-        self.set_optional(obj, 'transmittedErrorPacketsAccumulated', self.transmitted_error_packets_accumulated)
-        self.set_optional(obj, 'transmittedErrorPacketsDelta', self.transmitted_error_packets_delta)
-        self.set_optional(obj, 'transmittedMulticastPacketsAccumulated', self.transmitted_multicast_packets_accumulated)
-        self.set_optional(obj, 'transmittedMulticastPacketsDelta', self.transmitted_multicast_packets_delta)
-        self.set_optional(obj, 'transmittedOctetsAccumulated', self.transmitted_octets_accumulated)
-        self.set_optional(obj, 'transmittedOctetsDelta', self.transmitted_octets_delta)
-        self.set_optional(obj, 'transmittedTotalPacketsAccumulated', self.transmitted_total_packets_accumulated)
-        self.set_optional(obj, 'transmittedTotalPacketsDelta', self.transmitted_total_packets_delta)
-        self.set_optional(obj, 'transmittedUnicastPacketsAccumulated', self.transmitted_unicast_packets_accumulated)
-        self.set_optional(obj, 'transmittedUnicastPacketsDelta', self.transmitted_unicast_packets_delta)
-        return obj
+    __slots__ = ('values_are_suspect', 'v_nic_identifier') + ves_attributes(
+        ('received', 'transmitted'), ('broadcast_packets', 'discarded_packets',
+        'error_packets', 'multicast_packets', 'octets', 'total_packets',
+        'unicast_packets'), ('accumulated', 'delta'))
 
+@ves_datatype('cpu_identifier', required=('cpu_identifier', 'percent_usage'),
+              defaults={'percent_usage' : 0})
 class CpuUsage(VESDataType):
     """cpuUsage datatype"""
 
-    def __init__(self, identifier):
-        self.cpu_identifier = identifier
-        self.cpu_idle = None
-        self.cpu_usage_interrupt = None
-        self.cpu_usage_nice = None
-        self.cpu_usage_soft_irq = None
-        self.cpu_usage_steal = None
-        self.cpu_usage_system = None
-        self.cpu_usage_user = None
-        self.cpu_wait = None
-        self.percent_usage = 0
-
-    def get_obj(self):
-        obj = {
-            # required
-            'cpuIdentifier' : self.cpu_identifier,
-            'percentUsage' : self.percent_usage
-        }
-        # optional
-        self.set_optional(obj, 'cpuIdle', self.cpu_idle)
-        self.set_optional(obj, 'cpuUsageInterrupt', self.cpu_usage_interrupt)
-        self.set_optional(obj, 'cpuUsageNice', self.cpu_usage_nice)
-        self.set_optional(obj, 'cpuUsageSoftIrq', self.cpu_usage_soft_irq)
-        self.set_optional(obj, 'cpuUsageSteal', self.cpu_usage_steal)
-        self.set_optional(obj, 'cpuUsageSystem', self.cpu_usage_system)
-        self.set_optional(obj, 'cpuUsageUser', self.cpu_usage_user)
-        self.set_optional(obj, 'cpuWait', self.cpu_wait)
-        return obj
+    __slots__ = ('cpu_identifier', 'percent_usage', 'cpu_idle', 'cpu_usage_interrupt',
+                 'cpu_usage_nice', 'cpu_usage_soft_irq', 'cpu_usage_steal',
+                 'cpu_usage_system', 'cpu_usage_user', 'cpu_wait')
 
+@ves_datatype('vm_identifier', required=('memory_free', 'memory_used', 'vm_identifier'),
+              computed={'memory_free' : 'get_memory_free', 'memory_used' : 'get_memory_used'})
 class MemoryUsage(VESDataType):
     """memoryUsage datatype"""
 
-    def __init__(self, identifier):
-        self.memory_buffered = None
-        self.memory_cached = None
-        self.memory_configured = None
-        self.memory_free = None
-        self.memory_slab_recl = None
-        self.memory_slab_unrecl = None
-        self.memory_used = None
-        self.vm_identifier = identifier
+    __slots__ = ('memory_free', 'memory_used', 'vm_identifier', 'memory_buffered',
+                 'memory_cached', 'memory_configured', 'memory_slab_recl',
+                 'memory_slab_unrecl')
 
     def __str__(self):
         """ for debug purposes """
@@ -385,21 +329,6 @@ class MemoryUsage(VESDataType):
         else:
             return self.memory_configured
 
-    def get_obj(self):
-        obj = {
-            # required fields
-            'memoryFree' : self.get_memory_free(),
-            'memoryUsed' : self.get_memory_used(),
-            'vmIdentifier' : self.vm_identifier
-        }
-        # optional fields
-        self.set_optional(obj, 'memoryBuffered', self.memory_buffered)
-        self.set_optional(obj, 'memoryCached', self.memory_cached)
-        self.set_optional(obj, 'memoryConfigured', self.memory_configured)
-        self.set_optional(obj, 'memorySlabRecl', self.memory_slab_recl)
-        self.set_optional(obj, 'memorySlabUnrecl', self.memory_slab_unrecl)
-        return obj
-
 class MeasurementsForVfScaling(Event):
     """MeasurementsForVfScaling datatype"""
 
@@ -516,34 +445,1593 @@ class Fault(Event):
         obj['eventCategory'] = self.event_category
         return obj
 
+class SeriesAggregate(object):
+    """Running count, sum, min, max and last of the values of one series, the
+    values of counter series are aggregated as rates, see add_rates()"""
+
+    __slots__ = ('count', 'sum', 'min', 'max', 'last')
+
+    def __init__(self, size):
+        """Construct empty aggregate of size values"""
+        self.count = 0
+        self.sum = [0] * size
+        self.min = [None] * size
+        self.max = [None] * size
+        self.last = [None] * size
+
+    def add(self, values):
+        """Add the values of one sample"""
+        self.count += 1
+        self.last = values
+        for index, value in enumerate(values):
+            self.sum[index] += value
+            if self.min[index] is None or value < self.min[index]:
+                self.min[index] = value
+            if self.max[index] is None or value > self.max[index]:
+                self.max[index] = value
+
+    def add_rates(self, pre_values, values, interval):
+        """Add the rates (per sec) of the counter values of one sample since
+        the previous sample. The sample is skipped if no time has passed or a
+        counter went backwards (it has been reset)"""
+        if interval <= 0:
+            return
+        rates = []
+        for pre_value, value in zip(pre_values, values):
+            if value < pre_value:
+                return
+            rates.append((value - pre_value) / float(interval))
+        self.add(rates)
+
+    def avg(self, index):
+        """Average of the value at index"""
+        return float(self.sum[index]) / self.count
+
+    def reset(self):
+        """Start new aggregation window"""
+        self.__init__(len(self.sum))
+
+class CacheRecord(object):
+    """Record of one series in the PluginCache columns. The attributes of the
+    series are read and set by name like the items of a dict: host,
+    plugin_instance, type, type_instance, values, pre_values, time, pre_time,
+    updated, aggregate and field_names"""
+
+    __slots__ = ('cache', 'sid', 'aggregate', 'field_names')
+
+    def __init__(self, cache, sid):
+        """Construct the record of the series id in the cache"""
+        self.cache = cache
+        self.sid = sid
+        # aggregate of the values since the last event and additional field
+        # names of the values, made on first use
+        self.aggregate = None
+        self.field_names = None
+
+    def __getitem__(self, name):
+        cache = self.cache
+        if name == 'updated':
+            return cache.updated[self.sid] != 0
+        if name == 'values':
+            return cache.get_values(self.sid)
+        if name == 'type':
+            return cache.keys[self.sid][1]
+        if name == 'type_instance':
+            return cache.keys[self.sid][2]
+        if name == 'plugin_instance':
+            return cache.keys[self.sid][0]
+        if name == 'time':
+            return cache.times[self.sid]
+        if name == 'pre_values':
+            return cache.get_values(self.sid, previous=True)
+        if name == 'pre_time':
+            return cache.pre_times[self.sid]
+        if name == 'host':
+            return cache.hosts[self.sid]
+        if name == 'aggregate':
+            return self.aggregate
+        if name == 'field_names':
+            return self.field_names
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        if name == 'updated':
+            self.cache.updated[self.sid] = 1 if value else 0
+        elif name == 'field_names':
+            self.field_names = value
+        elif name == 'aggregate':
+            self.aggregate = value
+        else:
+            raise KeyError(name)
+
+# value list written by collectd, only the fields used by the cache are kept.
+# The written values wait for the cache update as plain tuples of the fields,
+# which are faster to make in the write callback
+WrittenValues = namedtuple('WrittenValues', ('host', 'plugin', 'plugin_instance', 'type',
+                                             'type_instance', 'time', 'interval', 'values'))
+
+class PluginCache(object):
+    """Indexed cache of collectd values received from one plugin. The series
+    are numbered in the order they were first received, the series id is an
+    index to the columns of the series attributes. The values of all series
+    are stored in one column, at the offset of the series: an array of
+    floats for gauges and a list of Python integers for the integer data
+    sources, so that 64-bit counters stay exact"""
+
+    def __init__(self, aggregate_types=()):
+        """Construct an empty cache, values of aggregate_types are aggregated"""
+        self.interval = 0.0
+        # time of the newest value received
+        self.last_time = 0.0
+        self.__aggregate_types = aggregate_types
+        # records of all series by series id
+        self.vls = []
+        # series id columns: interned (plugin_instance, type, type_instance)
+        # and host, offset and number of the values, time of the values and
+        # of the previous values, flags of updated series, series which values
+        # have been taken by deltas() and series of integer values
+        self.keys = []
+        self.hosts = []
+        self.offsets = array('l')
+        self.sizes = array('l')
+        self.times = array('d')
+        self.pre_times = array('d')
+        self.updated = bytearray()
+        self.ticked = bytearray()
+        self.integral = bytearray()
+        # value columns: current and previous values and the values at the
+        # time the last event was built from the series, of float and of
+        # integer series
+        self.values = array('d')
+        self.pre_values = array('d')
+        self.tick_values = array('d')
+        self.int_values = []
+        self.int_pre_values = []
+        self.int_tick_values = []
+        # (plugin_instance, type, type_instance) -> record
+        self.__by_key = {}
+        # secondary indexes: plugin_instance/type -> list of records
+        self.__by_plugin_instance = {}
+        self.__by_type = {}
+
+    def __len__(self):
+        return len(self.vls)
+
+    def value_columns(self, sid):
+        """Get the current, previous and last event value columns of the
+        series id"""
+        if self.integral[sid]:
+            return self.int_values, self.int_pre_values, self.int_tick_values
+        return self.values, self.pre_values, self.tick_values
+
+    def get_values(self, sid, previous=False):
+        """Get the current or previous values of the series id as a list"""
+        offset = self.offsets[sid]
+        values = self.value_columns(sid)[1 if previous else 0][offset:offset + self.sizes[sid]]
+        if self.integral[sid]:
+            return values
+        return values.tolist()
+
+    def update(self, vl):
+        """Update the record of the value or create new one, return True
+        if new record has been created"""
+        key = (vl.plugin_instance, vl.type, vl.type_instance)
+        value = self.__by_key.get(key)
+        if vl.time > self.last_time:
+            self.last_time = vl.time
+        if value is not None:
+            # record found, so just update time the values
+            sid = value.sid
+            size = self.sizes[sid]
+            if len(vl.values) != size:
+                # the values are stored in place, see remove()
+                raise ValueError('{} values written to {}/{}/{} of {} values'.format(
+                    len(vl.values), vl.plugin_instance, vl.type, vl.type_instance, size))
+            times = self.times
+            self.pre_times[sid] = times[sid]
+            times[sid] = vl.time
+            offset = self.offsets[sid]
+            integral = self.integral[sid]
+            if integral:
+                values = self.int_values
+                pre_values = self.int_pre_values
+            else:
+                values = self.values
+                pre_values = self.pre_values
+            # most types have one or two data sources
+            if size == 1:
+                pre_values[offset] = values[offset]
+                values[offset] = vl.values[0]
+            elif size == 2:
+                pre_values[offset] = values[offset]
+                pre_values[offset + 1] = values[offset + 1]
+                values[offset], values[offset + 1] = vl.values
+            else:
+                end = offset + size
+                pre_values[offset:end] = values[offset:end]
+                values[offset:end] = list(vl.values) if integral else array('d', vl.values)
+            self.updated[sid] = 1
+            if value.aggregate is not None:
+                value.aggregate.add_rates(self.get_values(sid, previous=True), vl.values,
+                                          vl.time - self.pre_times[sid])
+            return False
+        # create new cache record, the values are converted first, so the
+        # columns are left intact if they are not numbers
+        integral = all(isinstance(val, INTEGER_TYPES) for val in vl.values)
+        new_values = list(vl.values) if integral else array('d', vl.values)
+        key = tuple(intern(name) for name in key)
+        sid = len(self.vls)
+        value = CacheRecord(self, sid)
+        self.keys.append(key)
+        self.hosts.append(intern(vl.host))
+        self.integral.append(integral)
+        values, pre_values, tick_values = self.value_columns(sid)
+        self.offsets.append(len(values))
+        self.sizes.append(len(vl.values))
+        self.times.append(vl.time)
+        self.pre_times.append(vl.time)
+        self.updated.append(1)
+        self.ticked.append(0)
+        values.extend(new_values)
+        pre_values.extend(new_values)
+        tick_values.extend(new_values)
+        if vl.type in self.__aggregate_types:
+            # the first sample has no rate
+            value.aggregate = SeriesAggregate(len(vl.values))
+        self.__by_key[key] = value
+        self.__by_plugin_instance.setdefault(key[0], []).append(value)
+        self.__by_type.setdefault(key[1], []).append(value)
+        self.vls.append(value)
+        # update plugin interval based on one received in the value
+        self.interval = vl.interval
+        return True
+
+    def remove(self, records):
+        """Remove the records from the cache and its indexes, the columns are
+        compacted and the series renumbered"""
+        removed = set(id(val) for val in records)
+        plugin_instances = set()
+        types = set()
+        for val in records:
+            key = self.keys[val.sid]
+            del self.__by_key[key]
+            plugin_instances.add(key[0])
+            types.add(key[1])
+        self.vls, kept = [], self.vls
+        for val in kept:
+            if id(val) not in removed:
+                self.vls.append(val)
+        sids = [val.sid for val in self.vls]
+        offsets = self.offsets
+        sizes = self.sizes
+        integral = self.integral
+        for name in ('values', 'pre_values', 'tick_values'):
+            for prefix, flag in (('', 0), ('int_', 1)):
+                column = getattr(self, prefix + name)
+                compacted = [] if flag else array('d')
+                for sid in sids:
+                    if integral[sid] == flag:
+                        compacted.extend(column[offsets[sid]:offsets[sid] + sizes[sid]])
+                setattr(self, prefix + name, compacted)
+        for name in ('keys', 'hosts', 'sizes', 'times', 'pre_times', 'updated',
+                     'ticked', 'integral'):
+            column = getattr(self, name)
+            if isinstance(column, array):
+                setattr(self, name, array(column.typecode, [column[sid] for sid in sids]))
+            else:
+                setattr(self, name, type(column)(column[sid] for sid in sids))
+        self.offsets = array('l')
+        # next offset in the float and in the integer columns
+        offset = [0, 0]
+        for sid, val in enumerate(self.vls):
+            val.sid = sid
+            self.offsets.append(offset[self.integral[sid]])
+            offset[self.integral[sid]] += self.sizes[sid]
+        for index, names in ((self.__by_plugin_instance, plugin_instances),
+                             (self.__by_type, types)):
+            for name in names:
+                vals = [val for val in index[name] if id(val) not in removed]
+                if len(vals):
+                    index[name] = vals
+                else:
+                    del index[name]
+
+    def evict(self, ttl, last_time=None):
+        """Remove records not updated for ttl (sec) before the newest value
+        or last_time, if given, return number of removed records"""
+        min_time = (self.last_time if last_time is None else last_time) - ttl
+        stale = [val for val, time in zip(self.vls, self.times) if time < min_time]
+        if len(stale):
+            self.remove(stale)
+        return len(stale)
+
+    def mark_read(self):
+        """Mark all records as read"""
+        self.updated = bytearray(len(self.vls))
+
+    def rates(self, records, scale=1.0, unit=1.0):
+        """Get the change of the first value of each record since the previous
+        value per unit of time (sec) multiplied by scale, 0.0 if no time has
+        passed"""
+        offsets = self.offsets
+        times = self.times
+        pre_times = self.pre_times
+        rates = []
+        for val in records:
+            sid = val.sid
+            offset = offsets[sid]
+            interval = times[sid] - pre_times[sid]
+            if interval == 0:
+                rates.append(0.0)
+            else:
+                values, pre_values, _ = self.value_columns(sid)
+                rates.append((scale * (values[offset] - pre_values[offset])) / (interval * unit))
+        return rates
+
+    def deltas(self, records):
+        """Get the changes of the values of each record since the previous
+        call, None for the records not taken before. The current values are
+        the base of the next changes"""
+        offsets = self.offsets
+        sizes = self.sizes
+        deltas = []
+        for val in records:
+            sid = val.sid
+            start = offsets[sid]
+            end = start + sizes[sid]
+            values, _, tick_values = self.value_columns(sid)
+            if self.ticked[sid]:
+                deltas.append([value - tick_value for value, tick_value
+                               in zip(values[start:end], tick_values[start:end])])
+            else:
+                self.ticked[sid] = 1
+                deltas.append(None)
+            tick_values[start:end] = values[start:end]
+        return deltas
+
+    def get(self, plugin_instance=None, type_name=None, type_instance=None,
+            type_names=None):
+        """Get records by given criteria using the narrowest index"""
+        if None not in (plugin_instance, type_name, type_instance):
+            value = self.__by_key.get((plugin_instance, type_name, type_instance))
+            if value is None or (type_names is not None and type_name not in type_names):
+                return []
+            return [value]
+        if plugin_instance is not None:
+            candidates = self.__by_plugin_instance.get(plugin_instance, [])
+        elif type_name is not None:
+            candidates = self.__by_type.get(type_name, [])
+        else:
+            candidates = self.vls
+        return [val for val in candidates
+                if (type_name is None or type_name == val['type'])
+                and (plugin_instance is None or plugin_instance == val['plugin_instance'])
+                and (type_instance is None or type_instance == val['type_instance'])
+                and (type_names is None or val['type'] in type_names)]
+
+class ValueFilter(object):
+    """Include/exclude filter of values by "plugin/type/type_instance" glob
+    patterns, a missing part of a pattern matches anything. A value is
+    accepted if it matches an include pattern (or there are none) and does
+    not match any exclude pattern. The decision is memoized per plugin in
+    `plugins` if it does not depend on the type, otherwise per series"""
+
+    # maximum number of memoized series, the memo is cleared once it is full
+    # so the series of removed VMs (vNICs, disks) do not accumulate
+    MAX_SERIES = 65536
+
+    def __init__(self, include, exclude):
+        """Compile the patterns"""
+        self.__include = [self.compile(pattern) for pattern in include]
+        self.__exclude = [self.compile(pattern) for pattern in exclude]
+        # plugin -> True/False, missing if the decision depends on the type
+        self.plugins = {}
+        # plugins which need the per-series decision
+        self.__typed_plugins = set()
+        # (plugin, type, type_instance) -> True/False
+        self.__series = {}
+
+    @staticmethod
+    def compile(pattern):
+        """Compile pattern to a tuple of (plugin, type, type_instance) match
+        functions, None stands for any value"""
+        parts = pattern.split('/')
+        if len(parts) > 3:
+            raise ValueError("pattern '{}' has more than 3 parts".format(pattern))
+        parts += ['*'] * (3 - len(parts))
+        return tuple(None if part == '*' else re.compile(fnmatch.translate(part)).match
+                     for part in parts)
+
+    def __plugin_decision(self, plugin):
+        """Get decision of all values of the plugin, None if it depends on the
+        type or type instance"""
+        include = [x for x in self.__include if x[0] is None or x[0](plugin)]
+        exclude = [x for x in self.__exclude if x[0] is None or x[0](plugin)]
+        if any(x[1] is None and x[2] is None for x in exclude):
+            return False
+        if self.__include and not include:
+            return False
+        if any(x[1] is not None or x[2] is not None for x in include + exclude):
+            return None
+        return True
+
+    def accept(self, vl):
+        """Return True if the value is accepted by the filter"""
+        accepted = self.plugins.get(vl.plugin)
+        if accepted is not None:
+            return accepted
+        if vl.plugin not in self.__typed_plugins:
+            accepted = self.__plugin_decision(vl.plugin)
+            if accepted is not None:
+                self.plugins[vl.plugin] = accepted
+                return accepted
+            self.__typed_plugins.add(vl.plugin)
+        key = (vl.plugin, vl.type, vl.type_instance)
+        accepted = self.__series.get(key)
+        if accepted is None:
+            def matches(patterns):
+                return any((x[1] is None or x[1](vl.type)) and
+                           (x[2] is None or x[2](vl.type_instance))
+                           for x in patterns if x[0] is None or x[0](vl.plugin))
+            accepted = (not self.__include or matches(self.__include)) and \
+                not matches(self.__exclude)
+            if len(self.__series) >= self.MAX_SERIES:
+                self.__series = {}
+            self.__series[key] = accepted
+        return accepted
+
+class HTTPConnectionPool(object):
+    """Pool of persistent (keep-alive) HTTP/HTTPS connections to one server"""
+
+    def __init__(self, host, port, use_https=False, size=1, idle_timeout=30.0,
+                 timeout=1):
+        """Construct an empty pool, connections are opened on demand"""
+        self.__host = host
+        self.__port = port
+        self.__connection_class = httplib.HTTPSConnection if use_https \
+            else httplib.HTTPConnection
+        self.__size = size
+        self.__idle_timeout = idle_timeout
+        self.__timeout = timeout
+        # idle connections with the time they were last used
+        self.__idle = []
+        self.__lock = Lock()
+
+    def __get_connection(self):
+        """Get an idle connection or create new one"""
+        now = time.time()
+        with self.__lock:
+            while len(self.__idle):
+                conn, last_used = self.__idle.pop()
+                if (now - last_used) < self.__idle_timeout:
+                    return conn, True
+                # connection has been idle for too long
+                conn.close()
+        return self.__connection_class(self.__host, self.__port,
+                                       timeout=self.__timeout), False
+
+    def __put_connection(self, conn):
+        """Return connection to the pool or close it if the pool is full"""
+        with self.__lock:
+            if len(self.__idle) < self.__size:
+                self.__idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    @staticmethod
+    def is_unanswered(error):
+        """Return True if the request error means the connection was closed
+        before any response was received"""
+        if isinstance(error, httplib.BadStatusLine):
+            # the status line is empty, the connection has been closed
+            return error.line in ('', "''")
+        return isinstance(error, socket.error)
+
+    def request(self, method, path, body=None, headers={}):
+        """Send the request and return the response with body already read.
+        A request failed on a reused connection is sent again only if no
+        response has been received, so the request is not sent twice once
+        the server has answered it"""
+        conn, reused = self.__get_connection()
+        answered = False
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            answered = True
+            response.read()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (socket.error, httplib.HTTPException) as e:
+            conn.close()
+            if not reused or answered or not self.is_unanswered(e):
+                raise
+            # the server has likely closed the idle keep-alive connection,
+            # so drop the rest of the idle connections and retry on a new one
+            self.close()
+            conn, reused = self.__get_connection()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                response.read()
+            except:
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.__put_connection(conn)
+        return response
+
+    def close(self):
+        """Close all idle connections"""
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for conn, last_used in idle:
+            conn.close()
+
+class EventSpool(object):
+    """Append-only on-disk log of VES requests which failed to be delivered
+
+    The log is split into segment files which are deleted once replayed or,
+    when the spool exceeds its size limit, evicted oldest first.
+    """
+
+    SUFFIX = '.spool'
+    # record header: body length, number of events, request path length
+    HEADER = struct.Struct('!IIH')
+
+    def __init__(self, path, max_bytes):
+        """Open the spool directory and load the segments left in it"""
+        self.__path = path
+        self.__max_bytes = max_bytes
+        self.__segment_bytes = max(max_bytes // 16, self.HEADER.size)
+        # [sequence number, size, number of not replayed events], oldest first
+        self.__segments = deque()
+        self.__writer = None
+        self.__reader = None
+        self.__reader_seq = None
+        # (end offset, number of events) of each record returned by peek()
+        self.__record_ends = []
+        self.__bytes = 0
+        self.__count = 0
+        # number of events lost because of the size limit
+        self.dropped = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in sorted(os.listdir(path)):
+            if name.endswith(self.SUFFIX) and name[:-len(self.SUFFIX)].isdigit():
+                self.__load_segment(int(name[:-len(self.SUFFIX)]))
+        self.__next_seq = self.__segments[-1][0] + 1 if len(self.__segments) else 0
+
+    def __len__(self):
+        """Number of events in the spool"""
+        return self.__count
+
+    def __segment_name(self, seq):
+        return os.path.join(self.__path, '{:016d}{}'.format(seq, self.SUFFIX))
+
+    def __load_segment(self, seq):
+        """Count the events of segment left by previous run"""
+        count = 0
+        size = 0
+        with open(self.__segment_name(seq), 'rb') as f:
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                body_len, events, path_len = self.HEADER.unpack(header)
+                f.seek(path_len + body_len, os.SEEK_CUR)
+                if f.tell() > os.fstat(f.fileno()).st_size:
+                    # the last record has been truncated
+                    break
+                count += events
+                size = f.tell()
+        self.__segments.append([seq, size, count])
+        self.__bytes += size
+        self.__count += count
+
+    def __remove_oldest(self):
+        """Delete the oldest segment, return number of its not replayed events"""
+        seq, size, count = self.__segments.popleft()
+        if self.__reader_seq == seq:
+            self.__reader.close()
+            self.__reader = self.__reader_seq = None
+            self.__record_ends = []
+        if self.__writer is not None and not len(self.__segments):
+            self.__writer.close()
+            self.__writer = None
+        os.remove(self.__segment_name(seq))
+        self.__bytes -= size
+        self.__count -= count
+        return count
+
+    def append(self, path, body, count):
+        """Append the request to the spool"""
+        path = path.encode()
+        record = self.HEADER.pack(len(body), count, len(path)) + path + body
+        if self.__writer is None or self.__segments[-1][1] >= self.__segment_bytes:
+            # start new segment
+            if self.__writer is not None:
+                self.__writer.close()
+            self.__writer = open(self.__segment_name(self.__next_seq), 'ab')
+            self.__segments.append([self.__next_seq, 0, 0])
+            self.__next_seq += 1
+        self.__writer.write(record)
+        self.__writer.flush()
+        self.__segments[-1][1] += len(record)
+        self.__segments[-1][2] += count
+        self.__bytes += len(record)
+        self.__count += count
+        while self.__bytes > self.__max_bytes and len(self.__segments) > 1:
+            self.dropped += self.__remove_oldest()
+
+    def peek(self, limit=1):
+        """Get list of (path, body, count) of up to limit oldest requests of
+        the oldest segment, empty if the spool is empty"""
+        while len(self.__segments):
+            seq = self.__segments[0][0]
+            if self.__reader_seq != seq:
+                self.__reader = open(self.__segment_name(seq), 'rb')
+                self.__reader_seq = seq
+            start = self.__reader.tell()
+            requests = []
+            self.__record_ends = []
+            while len(requests) < limit:
+                header = self.__reader.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                body_len, count, path_len = self.HEADER.unpack(header)
+                path = self.__reader.read(path_len)
+                body = self.__reader.read(body_len)
+                if len(path) < path_len or len(body) < body_len:
+                    break
+                requests.append((path.decode(), body, count))
+                self.__record_ends.append((self.__reader.tell(), count))
+            if len(requests):
+                # re-read the records next time unless removed by pop()
+                self.__reader.seek(start)
+                return requests
+            # end of the (possibly truncated) segment, everything is replayed
+            self.__remove_oldest()
+        return []
+
+    def pop(self, number=1):
+        """Remove the number of requests returned by the last peek()"""
+        if number > len(self.__record_ends):
+            return
+        offset = self.__record_ends[number - 1][0]
+        count = sum(record[1] for record in self.__record_ends[:number])
+        self.__reader.seek(offset)
+        self.__record_ends = []
+        self.__segments[0][2] -= count
+        self.__count -= count
+        if self.__segments[0][2] <= 0:
+            # the whole segment has been replayed
+            self.__remove_oldest()
+
+    def close(self):
+        """Close the spool files"""
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+        if self.__reader is not None:
+            self.__reader.close()
+            self.__reader = self.__reader_seq = None
+            self.__record_ends = []
+
+class EndpointHealth(object):
+    """Health of a listener endpoint. Each failed request delays the next one
+    by an exponential backoff with jitter (or by Retry-After of the response
+    if longer), the circuit is open after a number of consecutive failures,
+    until a request after the backoff succeeds"""
+
+    def __init__(self, name='', backoff_min=1.0, backoff_max=60.0, threshold=5):
+        """Construct healthy endpoint, threshold 0 disables the circuit breaker"""
+        self.name = name
+        self.__backoff_min = backoff_min
+        self.__backoff_max = max(backoff_max, backoff_min)
+        self.__threshold = threshold
+        self.__failures = 0
+        self.__retry_time = 0.0
+        self.__lock = Lock()
+        # number of failed requests and number of times the circuit opened
+        self.counters = {'failures' : 0, 'trips' : 0}
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Parse Retry-After header value (seconds or HTTP date) to seconds,
+        return None if it is missing or invalid"""
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            date = email.utils.parsedate_tz(value)
+            if date is None:
+                return None
+            return max(email.utils.mktime_tz(date) - time.time(), 0.0)
+
+    def success(self):
+        """Record successful request"""
+        with self.__lock:
+            if self.__threshold > 0 and self.__failures >= self.__threshold:
+                collectd.info('VES endpoint {} is available again'.format(self.name))
+            self.__failures = 0
+            self.__retry_time = 0.0
+
+    def failure(self, retry_after=None):
+        """Record failed request, retry_after is the delay (sec) requested
+        by the endpoint"""
+        with self.__lock:
+            self.__failures += 1
+            self.counters['failures'] += 1
+            backoff = min(self.__backoff_max,
+                          self.__backoff_min * 2 ** min(self.__failures - 1, 30))
+            # equal jitter, so the hosts do not retry at the same time
+            backoff = backoff / 2 + random.uniform(0, backoff / 2)
+            if retry_after is not None:
+                backoff = max(backoff, retry_after)
+            self.__retry_time = time.time() + backoff
+            if self.__failures == self.__threshold:
+                self.counters['trips'] += 1
+                collectd.warning('VES endpoint {} is not available, circuit is open'.format(
+                    self.name))
+
+    def delay(self):
+        """Time (sec) to wait before the next request"""
+        return max(self.__retry_time - time.time(), 0.0)
+
+    def is_open(self):
+        """Return True if the circuit is open, i.e. the endpoint has failed
+        too many times and no request should be sent until the backoff ends"""
+        return self.__threshold > 0 and self.__failures >= self.__threshold and \
+            time.time() < self.__retry_time
+
+class FailoverHealth(object):
+    """Health of endpoints used in active/standby failover, requests can be
+    sent if any of the endpoints is available"""
+
+    def __init__(self, healths):
+        """Construct the health of the group of endpoint healths"""
+        self.__healths = healths
+
+    def delay(self):
+        """Time (sec) to wait before the next request"""
+        return min(health.delay() for health in self.__healths)
+
+    def is_open(self):
+        """Return True if the circuits of all endpoints are open"""
+        return all(health.is_open() for health in self.__healths)
+
+class ListenerEndpoint(object):
+    """Vendor Event Listener endpoint with its connections and health. The
+    endpoint is posted to by one sender thread at a time, which updates its
+    self-telemetry counters"""
+
+    __slots__ = ('root', 'pool', 'health', 'sent_bytes', 'latency')
+
+    def __init__(self, root, pool, health, latency_buckets=0):
+        """Construct the endpoint of the server root URL, with request counters
+        of latency_buckets + 1 send latency buckets"""
+        self.root = root
+        self.pool = pool
+        self.health = health
+        # bytes sent and number of requests per latency bucket
+        self.sent_bytes = 0
+        self.latency = [0] * (latency_buckets + 1)
+
+class HashRing(object):
+    """Consistent hash ring of nodes. Each node has a number of points on the
+    ring, a key belongs to the node of the next point, so only the keys of a
+    node added or removed move to another node"""
+
+    # maximum number of memoized keys, the memo is cleared once it is full so
+    # the keys of removed VMs do not accumulate
+    MAX_KEYS = 65536
+
+    def __init__(self, nodes, replicas=100):
+        """Construct the ring of the node names"""
+        ring = sorted((self.hash('{}#{}'.format(node, replica)), index)
+                      for index, node in enumerate(nodes) for replica in range(replicas))
+        self.__points = [point for point, index in ring]
+        self.__nodes = [index for point, index in ring]
+        # key -> node index
+        self.__keys = {}
+
+    @staticmethod
+    def hash(key):
+        """Hash the key to a point on the ring"""
+        return struct.unpack('!I', hashlib.md5(key.encode('utf-8')).digest()[:4])[0]
+
+    def get(self, key):
+        """Get index of the node of the key"""
+        index = self.__keys.get(key)
+        if index is None:
+            if len(self.__keys) >= self.MAX_KEYS:
+                self.__keys = {}
+            point = bisect.bisect(self.__points, self.hash(key)) % len(self.__points)
+            index = self.__keys[key] = self.__nodes[point]
+        return index
+
+class EventSender(object):
+    """Worker thread sending queued VES requests outside of collectd callbacks
+
+    Requests queued with a due time (paced requests) are sent not before that
+    time, the others as soon as possible. Requests which could not be
+    delivered because the listener is not available are written to the
+    spool (if any) and replayed, at limited rate and in batches if possible,
+    only when there is no live request waiting to be sent. No request is sent during the backoff of the
+    endpoint health, while its circuit is open the requests are spooled.
+    """
+
+    # time (sec) to wait before replaying the spool after spool read error
+    RETRY_INTERVAL = 10.0
+
+    def __init__(self, send, size, overwrite=True, spool=None, replay_rate=10.0,
+                 health=None, batch=None, batch_size=1):
+        """Construct the sender, send(path, body) is called on worker thread
+        and is expected to record its result in the health. Up to batch_size
+        spooled requests are replayed at once, batch(requests) makes one
+        (path, body, count, number of requests) request of the first of them"""
+        self.__send = send
+        self.__batch = batch
+        self.__batch_size = batch_size if batch is not None else 1
+        self.__health = health if health is not None else EndpointHealth()
+        self.__size = size
+        # drop the oldest queued request if True, otherwise drop the new one
+        self.__overwrite = overwrite
+        self.__spool = spool
+        self.__replay_period = 1.0 / replay_rate if replay_rate > 0 else 0.0
+        self.__replay_time = 0.0
+        # requests to be sent immediately
+        self.__queue = deque()
+        # heap of paced requests ordered by due time (and sequence number)
+        self.__paced = []
+        self.__paced_seq = 0
+        self.__cond = Condition()
+        self.__running = False
+        self.__thread = None
+        self.__full = False
+        # number of events sent, failed to be sent, dropped and spooled
+        self.counters = {'sent' : 0, 'failed' : 0, 'dropped' : 0, 'spooled' : 0}
+
+    def __len__(self):
+        """Number of events waiting in the queue"""
+        with self.__cond:
+            return sum(request[2] for request in self.__queue) + \
+                sum(request[-1] for request in self.__paced)
+
+    def start(self):
+        """Start the worker thread"""
+        self.__running = True
+        self.__thread = Thread(target=self.__run, name='ves_sender')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker thread once the queue is flushed or timeout expires,
+        paced requests are flushed without waiting for their due time"""
+        with self.__cond:
+            self.__running = False
+            self.__cond.notify()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def put(self, path, body, count=1, due=None):
+        """Queue the request body carrying count events to be sent not before
+        due time (if given), return False if dropped"""
+        with self.__cond:
+            if len(self.__queue) + len(self.__paced) >= self.__size:
+                if not self.__full:
+                    collectd.warning('VES send queue is full, dropping {} events'.format(
+                        'oldest' if self.__overwrite else 'new'))
+                    self.__full = True
+                if not self.__overwrite:
+                    self.counters['dropped'] += count
+                    return False
+                if len(self.__paced):
+                    self.counters['dropped'] += heapq.heappop(self.__paced)[-1]
+                else:
+                    self.counters['dropped'] += self.__queue.popleft()[2]
+            else:
+                self.__full = False
+            if due is None:
+                self.__queue.append((path, body, count))
+            else:
+                self.__paced_seq += 1
+                heapq.heappush(self.__paced, (due, self.__paced_seq, path, body, count))
+            self.__cond.notify()
+        return True
+
+    def __replay_wait(self, delay):
+        """Time to wait for the next replay, None if there is nothing to replay"""
+        if self.__spool is None or not len(self.__spool):
+            return None
+        return max(self.__replay_time - time.time(), delay)
+
+    def __next_request(self):
+        """Wait for the next request to be sent (or spooled if the circuit is
+        open), return the request, None if the spool should be replayed or
+        False if the sender is stopped"""
+        while True:
+            delay = self.__health.delay()
+            # the requests are taken without waiting for the backoff if they
+            # are to be spooled
+            ready = delay == 0.0 or not self.__running or \
+                (self.__spool is not None and self.__health.is_open())
+            waits = []
+            if len(self.__queue):
+                if ready:
+                    return self.__queue.popleft()
+                waits.append(delay)
+            if len(self.__paced):
+                if not self.__running or (ready and self.__paced[0][0] <= time.time()):
+                    return heapq.heappop(self.__paced)[2:]
+                waits.append(max(self.__paced[0][0] - time.time(), delay))
+            if not self.__running:
+                return False
+            replay_wait = self.__replay_wait(delay)
+            if replay_wait is not None:
+                if replay_wait == 0.0:
+                    return None
+                waits.append(replay_wait)
+            self.__cond.wait(min(waits) if len(waits) else None)
+
+    def __spool_request(self, path, body, count):
+        """Write the request to the spool, return False if it is not possible"""
+        if self.__spool is None:
+            return False
+        try:
+            self.__spool.append(path, body, count)
+        except (IOError, OSError) as e:
+            collectd.error('VES spool write error: {}'.format(e))
+            return False
+        self.counters['spooled'] += count
+        return True
+
+    def __deliver(self, path, body, count):
+        """Send live request, spool it if the listener is not available"""
+        result = self.__send(path, body)
+        if result:
+            self.counters['sent'] += count
+            return
+        if result is None:
+            # listener is not available, the replay waits for the backoff
+            if self.__spool_request(path, body, count):
+                return
+        self.counters['failed'] += count
+
+    def __replay(self):
+        """Replay the oldest spooled requests"""
+        try:
+            requests = self.__spool.peek(self.__batch_size)
+            if not len(requests):
+                return
+            if len(requests) > 1:
+                path, body, count, number = self.__batch(requests)
+            else:
+                (path, body, count), number = requests[0], 1
+            result = self.__send(path, body)
+            if result is None:
+                # keep the requests in the spool and retry after the backoff
+                return
+            self.__spool.pop(number)
+        except (IOError, OSError) as e:
+            collectd.error('VES spool read error: {}'.format(e))
+            self.__replay_time = time.time() + self.RETRY_INTERVAL
+            return
+        self.__replay_time = time.time() + self.__replay_period
+        if result:
+            self.counters['sent'] += count
+        else:
+            self.counters['failed'] += count
+
+    def __run(self):
+        """Worker thread"""
+        while True:
+            with self.__cond:
+                request = self.__next_request()
+                running = self.__running
+            if request is False:
+                # stopped and the queue is flushed
+                if self.__spool is not None:
+                    self.__spool.close()
+                return
+            if request is None:
+                self.__replay()
+            elif (not running or self.__health.is_open()) and \
+                    self.__spool_request(*request):
+                # stopping or the circuit is open, keep the request in the
+                # spool for next run or until the endpoint recovers
+                continue
+            else:
+                self.__deliver(*request)
+
+class TokenBucket(object):
+    """Token bucket of a rate limiter"""
+
+    __slots__ = ('tokens', 'time')
+
+    def __init__(self, tokens, now):
+        """Construct the bucket holding the tokens"""
+        self.tokens = tokens
+        self.time = now
+
+    def refill(self, rate, burst, now):
+        """Add the tokens accumulated since the last refill"""
+        self.tokens = min(burst, self.tokens + (now - self.time) * rate)
+        self.time = now
+
+class NotificationAggregator(object):
+    """Coalesce repeated notifications and limit the rate of notifications
+    per source. The first notification of a key is sent immediately, the
+    repeats of it until the next flush are collapsed into one summary.
+    Notifications over the rate are collapsed the same way, so they are
+    delayed but never lost"""
+
+    def __init__(self, window, rate, burst):
+        """Construct the aggregator, window > 0 enables coalescing of repeats,
+        rate > 0 (notifications per second, up to burst at once) enables rate
+        limiting"""
+        self.__window = window
+        self.__rate = rate
+        self.__burst = max(burst, 1.0)
+        # key -> [repeats, first time, last time, last notification, source]
+        self.__entries = {}
+        # source -> token bucket
+        self.__buckets = {}
+        self.__lock = Lock()
+        # number of notifications coalesced as repeats and because of the rate
+        self.counters = {'coalesced' : 0, 'rate_limited' : 0}
+
+    def __take(self, source, now):
+        """Take a token of the source, return False if there is none"""
+        if self.__rate <= 0:
+            return True
+        bucket = self.__buckets.get(source)
+        if bucket is None:
+            bucket = self.__buckets[source] = TokenBucket(self.__burst, now)
+        else:
+            bucket.refill(self.__rate, self.__burst, now)
+        if bucket.tokens < 1.0:
+            return False
+        bucket.tokens -= 1.0
+        return True
+
+    def add(self, key, source, n, now):
+        """Add the notification, return True if it is to be sent now"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                if self.__take(source, now):
+                    if self.__window > 0:
+                        self.__entries[key] = [0, None, None, n, source]
+                    return True
+                self.counters['rate_limited'] += 1
+                entry = self.__entries[key] = [0, None, None, n, source]
+            else:
+                self.counters['coalesced'] += 1
+            if entry[1] is None:
+                entry[1] = n.time
+            entry[0] += 1
+            entry[2] = n.time
+            entry[3] = n
+            return False
+
+    def flush(self, now, limit=True):
+        """Return (notification, repeats, first time, last time) summaries of
+        the collapsed notifications ordered by the last time, summaries over
+        the rate are kept until the next flush unless limit is False"""
+        summaries = []
+        with self.__lock:
+            entries = {}
+            for key, entry in self.__entries.items():
+                repeats, first, last, n, source = entry
+                if repeats == 0:
+                    continue
+                if not limit or self.__take(source, now):
+                    summaries.append((n, repeats, first, last))
+                else:
+                    entries[key] = entry
+            self.__entries = entries
+            # full buckets are the same as new ones
+            for source, bucket in list(self.__buckets.items()):
+                bucket.refill(self.__rate, self.__burst, now)
+                if bucket.tokens >= self.__burst:
+                    del self.__buckets[source]
+        summaries.sort(key=lambda x: x[3])
+        return summaries
+
+class IntervalScheduler(object):
+    """Long-lived thread calling the callback on wall-clock aligned interval
+    boundaries (multiples of the interval since the epoch), so the period does
+    not drift by the callback duration"""
+
+    def __init__(self, interval, callback, catch_up=False):
+        """Construct the scheduler, if catch_up is True the ticks missed
+        because of overrun are run immediately, otherwise they are skipped"""
+        self.__interval = interval
+        self.__callback = callback
+        self.__catch_up = catch_up
+        self.__stop = ThreadEvent()
+        self.__thread = None
+        # number of ticks which took longer than the interval and number of
+        # ticks skipped because of that
+        self.overruns = 0
+        self.skipped = 0
+
+    def start(self):
+        """Start the scheduler thread"""
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name='ves_timer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the scheduler thread, the running tick is not interrupted but
+        waited for until timeout expires"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def next_boundary(self, now):
+        """Get the first interval boundary after now"""
+        return (math.floor(now / self.__interval) + 1) * self.__interval
+
+    def __run(self):
+        """Scheduler thread"""
+        next_time = self.next_boundary(time.time())
+        while True:
+            now = time.time()
+            if next_time - now > self.__interval:
+                # the clock has been set back
+                next_time = self.next_boundary(now)
+            if next_time > now:
+                self.__stop.wait(next_time - now)
+            if self.__stop.is_set():
+                return
+            start = time.time()
+            try:
+                self.__callback()
+            except Exception as e:
+                collectd.error('VES timer callback error: {}'.format(e))
+            next_time += self.__interval
+            now = time.time()
+            if now < next_time or start >= next_time:
+                # in time or catching up the ticks missed before
+                continue
+            # the tick has overrun the next boundary
+            self.overruns += 1
+            missed = int((now - next_time) // self.__interval) + 1
+            collectd.warning('VES timer tick took {:.3f} sec, longer than interval {} sec, '
+                             '{} ticks {}'.format(now - start, self.__interval, missed,
+                             'to catch up' if self.__catch_up else 'skipped'))
+            if not self.__catch_up:
+                self.skipped += missed
+                next_time += missed * self.__interval
+
+class HelperProcess(object):
+    """Helper process running the cache, event building and delivery of the
+    plugin outside of collectd (see helper_main()). The written values and
+    notifications are taken from the plugin and sent to the helper in batches
+    by a forwarder thread, log messages and values dispatched by the helper
+    are passed to collectd by a reader thread. The helper is restarted if it
+    exits"""
+
+    # time (sec) between the batches and before restarting failed helper
+    FLUSH_INTERVAL = 0.1
+    RESTART_INTERVAL = 10.0
+
+    def __init__(self, command, setup, take_pending, name=''):
+        """Construct the helper of the command line, setup is the message sent
+        first to each helper started, take_pending() returns the values and
+        notifications to be sent to it. The name of the helper is the plugin
+        instance of the values it dispatches"""
+        self.__command = command
+        self.name = name
+        self.__setup = setup
+        self.__take_pending = take_pending
+        self.__process = None
+        self.__host = None
+        # types which data sets have been sent to the helper
+        self.__types = set()
+        # serializes the messages written to the pipe
+        self.__lock = Lock()
+        self.__stop = ThreadEvent()
+        self.__thread = None
+        # number of helper restarts and values dropped while it was not running
+        self.counters = {'restarts' : 0, 'dropped' : 0}
+
+    def start(self):
+        """Start the helper process and the forwarder thread"""
+        self.__spawn()
+        self.__thread = Thread(target=self.__run, name='ves_helper')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        """Send the rest of the values and stop the helper, it is killed if it
+        does not exit in time. With timeout 0 the helper is only asked to stop,
+        so that more helpers can be stopped at once"""
+        self.__stop.set()
+        if timeout == 0:
+            return
+        deadline = time.time() + (timeout if timeout is not None else 3600.0)
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        with self.__lock:
+            process, self.__process = self.__process, None
+        if process is None:
+            return
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if process.poll() is None:
+            collectd.warning('VES helper process {} did not exit, killing it'.format(process.pid))
+            process.kill()
+
+    def set_host(self, host):
+        """Send the host name to the helper"""
+        self.__host = host
+        self.send(('host', host))
+
+    def send(self, message):
+        """Send the message to the helper, return False if it is not running"""
+        with self.__lock:
+            if self.__process is None:
+                return False
+            try:
+                pickle.dump(message, self.__process.stdin, 2)
+                self.__process.stdin.flush()
+            except (IOError, OSError, ValueError) as e:
+                collectd.error('VES helper process {} failed: {}'.format(self.__process.pid, e))
+                self.__process = None
+                return False
+        return True
+
+    def __spawn(self):
+        """Start the helper process and its reader thread"""
+        try:
+            process = subprocess.Popen(self.__command, stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, close_fds=True)
+        except OSError as e:
+            collectd.error('VES helper process cannot be started: {}'.format(e))
+            return
+        reader = Thread(target=self.__read, args=(process,), name='ves_helper_reader')
+        reader.daemon = True
+        reader.start()
+        with self.__lock:
+            self.__process = process
+        self.__types = set()
+        self.send(self.__setup)
+        if self.__host is not None:
+            self.send(('host', self.__host))
+        collectd.info('VES helper process {} started'.format(process.pid))
+
+    def __read(self, process):
+        """Pass the messages of the helper to collectd until it exits"""
+        while True:
+            try:
+                message = pickle.load(process.stdout)
+            except Exception:
+                # EOF or broken message, the helper has exited
+                break
+            if message[0] == 'log':
+                getattr(collectd, message[1])(message[2])
+            elif message[0] == 'dispatch':
+                vl = collectd.Values(plugin=message[1], plugin_instance=self.name,
+                                     type=message[2], type_instance=message[3])
+                vl.dispatch(values=message[4])
+        process.stdout.close()
+
+    def __forward(self):
+        """Send the values and notifications written since the last call"""
+        values, notifications = self.__take_pending()
+        if len(values):
+            # the type is the fourth field of the written values
+            types = set(value[3] for value in values) - self.__types
+            if len(types):
+                datasets = {}
+                for type_name in types:
+                    try:
+                        datasets[type_name] = collectd.get_dataset(type_name)
+                    except TypeError:
+                        collectd.warning('VES helper: unknown type {}'.format(type_name))
+                self.send(('datasets', datasets))
+                self.__types.update(types)
+            if not self.send(('values', values)):
+                self.counters['dropped'] += len(values)
+        if len(notifications):
+            self.send(('notify', [(n.host, n.plugin, n.plugin_instance, n.type,
+                n.type_instance, n.time, n.severity, n.message) for n in notifications]))
+
+    def __run(self):
+        """Forwarder thread"""
+        restart_time = 0.0
+        while not self.__stop.wait(self.FLUSH_INTERVAL):
+            process = self.__process
+            if process is not None and process.poll() is not None:
+                collectd.error('VES helper process {} exited with {}'.format(
+                    process.pid, process.returncode))
+                with self.__lock:
+                    self.__process = None
+                process = None
+            if process is None:
+                if restart_time == 0.0:
+                    restart_time = time.time() + self.RESTART_INTERVAL
+                if time.time() >= restart_time:
+                    restart_time = 0.0
+                    self.counters['restarts'] += 1
+                    self.__spawn()
+            self.__forward()
+        # send the rest of the values and let the helper exit once it has
+        # processed them
+        self.__forward()
+        self.send(('stop',))
+        with self.__lock:
+            if self.__process is not None:
+                self.__process.stdin.close()
+
+class HelperCollectd(object):
+    """Stand-in of the collectd module in the helper process, log messages
+    and dispatched values are sent to the plugin process"""
+
+    NOTIF_FAILURE = 1
+    NOTIF_WARNING = 2
+    NOTIF_OKAY = 4
+
+    def __init__(self, output):
+        """Construct the module writing the messages to the output"""
+        self.__output = output
+        self.__lock = Lock()
+        # data sets of the types sent by the plugin process
+        self.datasets = {}
+        self.Values = HelperValues
+        for level in ('debug', 'info', 'notice', 'warning', 'error'):
+            setattr(self, level, functools.partial(self.log, level))
+
+    def send(self, message):
+        """Send the message to the plugin process"""
+        with self.__lock:
+            pickle.dump(message, self.__output, 2)
+            self.__output.flush()
+
+    def log(self, level, message):
+        """Log the message in collectd"""
+        self.send(('log', level, message))
+
+    def get_dataset(self, type_name):
+        """Get data sources of the type"""
+        try:
+            return self.datasets[type_name]
+        except KeyError:
+            raise TypeError('Dataset {} not found'.format(type_name))
+
+    def unregister_read(self, callback):
+        """The helper has no read callback"""
+        pass
+
+class HelperValues(object):
+    """Value list in the helper process"""
+
+    __slots__ = ('host', 'plugin', 'plugin_instance', 'type', 'type_instance',
+                 'time', 'interval', 'values', 'meta')
+
+    def __init__(self, host='', plugin='', plugin_instance='', type='', type_instance='',
+                 time=0, interval=0, values=(), meta=None):
+        """Construct the value list"""
+        self.host = host
+        self.plugin = plugin
+        self.plugin_instance = plugin_instance
+        self.type = type
+        self.type_instance = type_instance
+        self.time = time
+        self.interval = interval
+        self.values = values
+        self.meta = meta
+
+    def dispatch(self, values=None):
+        """Dispatch the values in the plugin process"""
+        if values is not None:
+            self.values = values
+        collectd.send(('dispatch', self.plugin, self.type, self.type_instance,
+                       list(self.values)))
+
+class HelperNotification(object):
+    """Notification in the helper process"""
+
+    __slots__ = ('host', 'plugin', 'plugin_instance', 'type', 'type_instance',
+                 'time', 'severity', 'message')
+
+    def __init__(self, host, plugin, plugin_instance, type, type_instance, time,
+                 severity, message):
+        """Construct the notification"""
+        self.host = host
+        self.plugin = plugin
+        self.plugin_instance = plugin_instance
+        self.type = type
+        self.type_instance = type_instance
+        self.time = time
+        self.severity = severity
+        self.message = message
+
+class HelperConfig(object):
+    """Configuration block in the helper process"""
+
+    def __init__(self, key, values, children=()):
+        """Construct the block"""
+        self.key = key
+        self.values = values
+        self.children = list(children)
+
 class VESPlugin(object):
     """VES plugin with collectd callbacks"""
 
+    # virt plugin types and vNicPerformance fields of their (rx, tx) values
+    V_NIC_TYPES = (
+        ('if_packets', ('received_total_packets', 'transmitted_total_packets')),
+        ('if_octets', ('received_octets', 'transmitted_octets')),
+        ('if_errors', ('received_error_packets', 'transmitted_error_packets')),
+        ('if_dropped', ('received_discarded_packets', 'transmitted_discarded_packets'))
+    )
+    # virt plugin types and diskUsage fields of their (read, write) values
+    DISK_TYPES = (
+        ('disk_octets', ('disk_octets_read', 'disk_octets_write')),
+        ('disk_ops', ('disk_ops_read', 'disk_ops_write'))
+    )
+    # disk plugin types and diskUsage fields of their values, the counters
+    # are reported as rates, see set_aggregates()
+    HOST_DISK_TYPES = (
+        ('disk_octets', ('disk_octets_read', 'disk_octets_write')),
+        ('disk_ops', ('disk_ops_read', 'disk_ops_write')),
+        ('disk_time', ('disk_time_read', 'disk_time_write')),
+        ('disk_merged', ('disk_merged_read', 'disk_merged_write')),
+        ('disk_io_time', ('disk_io_time',)),
+        ('pending_operations', ('disk_pending_operations',))
+    )
+    # disk plugin types of gauges, reported as they are
+    HOST_DISK_GAUGES = ('pending_operations',)
+    # cpu plugin states and cpuUsage fields of their percentages
+    HOST_CPU_STATES = {
+        'user' : 'cpu_usage_user',
+        'system' : 'cpu_usage_system',
+        'idle' : 'cpu_idle',
+        'wait' : 'cpu_wait',
+        'interrupt' : 'cpu_usage_interrupt',
+        'softirq' : 'cpu_usage_soft_irq',
+        'steal' : 'cpu_usage_steal',
+        'nice' : 'cpu_usage_nice'
+    }
+    # memory plugin type instances and memoryUsage fields of their values
+    HOST_MEMORY_TYPES = {
+        'used' : 'memory_used',
+        'free' : 'memory_free',
+        'buffered' : 'memory_buffered',
+        'cached' : 'memory_cached',
+        'slab_recl' : 'memory_slab_recl',
+        'slab_unrecl' : 'memory_slab_unrecl'
+    }
+    # upper bounds (sec) of the self-telemetry HTTP send latency buckets
+    HTTP_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
     def __init__(self):
         """Plugin initialization"""
-        self.__plugin_data_cache = {
-            'cpu' : {'interval' : 0.0, 'vls' : []},
-            'virt' : {'interval' : 0.0, 'vls' : []},
-            'disk' : {'interval' : 0.0, 'vls' : []},
-            'interface' : {'interval' : 0.0, 'vls' : []},
-            'memory' : {'interval' : 0.0, 'vls' : []}
-        }
+        # plugin caches of each host partition and the caches and the host of
+        # the partition the events are built of; the values of all hosts are
+        # in one partition (None) unless they are partitioned by host
+        self.__plugin_data_cache = self.new_plugin_data_cache()
+        self.__partitions = {None : self.__plugin_data_cache}
+        self.__partition_host = None
         self.__plugin_config = {
             'Domain' : '127.0.0.1',
             'Port' : 30000.0,
+            'Endpoints' : [],
+            'EndpointMode' : 'failover',
             'Path' : '',
             'Username' : '',
             'Password' : '',
             'Topic' : '',
             'UseHttps' : False,
             'SendEventInterval' : 20.0,
+            'TickOverrunPolicy' : 'skip',
             'FunctionalRole' : 'Collectd VES Agent',
-            'ApiVersion' : 5.1
+            'ApiVersion' : 5.1,
+            'ConnectionPoolSize' : 2.0,
+            'ConnectionIdleTimeout' : 30.0,
+            'BackoffMin' : 1.0,
+            'BackoffMax' : 60.0,
+            'CircuitBreakerFailures' : 5.0,
+            'BatchSize' : 1.0,
+            'BatchMaxBytes' : 0.0,
+            'SendQueueSize' : 1000.0,
+            'SendQueuePolicy' : 'overwrite',
+            'Pacing' : False,
+            'SpoolPath' : '',
+            'SpoolMaxBytes' : 104857600.0,
+            'SpoolReplayRate' : 10.0,
+            'SpoolReplayBatchSize' : 10.0,
+            'CacheTTLIntervals' : 5.0,
+            'CacheMaxEntries' : 0.0,
+            'WriteQueueSize' : 1000000.0,
+            'JsonEncoder' : 'json',
+            'Compression' : 'none',
+            'CompressionMinBytes' : 1024.0,
+            'NotificationWindow' : 0.0,
+            'NotificationRate' : 0.0,
+            'NotificationBurst' : 10.0,
+            'SendHostEvent' : False,
+            'HostFieldsInVmEvents' : True,
+            'Include' : [],
+            'Exclude' : [],
+            'HelperProcess' : False,
+            'HelperInterpreter' : '',
+            'HelperWorkers' : 1.0,
+            'PartitionByHost' : False,
+            'SelfTelemetry' : False,
+            'Debug' : False
         }
         self.__host_name = None
         self.__ves_timer = None
+        self.__notifications = None
+        self.__notification_timer = None
+        # listener endpoints in the order of preference and the one in use
+        self.__endpoints = []
+        self.__active_endpoint = None
+        # ring of the endpoints if the events are sharded
+        self.__ring = None
+        self.__senders = []
+        # random phase offset (fraction of a slot) of the paced requests
+        self.__pacing_phase = random.random()
+        self.__json_dumps = json_dumps
+        self.__server_path = None
+        self.__batch_path = None
+        self.__http_headers = None
+        self.__compress = None
+        self.__compressed_http_headers = None
         self.__lock = Lock()
         self.__event_id = 0
+        # number of cached values and number of values evicted from the cache
+        # because of TTL (not updated) and LRU (cache size limit)
+        self.__cache_entries = 0
+        self.cache_evictions = {'ttl' : 0, 'lru' : 0}
+        # data source descriptors of collectd types
+        self.__datasets = {}
+        # values written since the cache was last updated (current
+        # generation), its size limit, whether it is full and the number of
+        # values dropped because it was full
+        self.__pending = []
+        self.__pending_lock = Lock()
+        self.__pending_max = sys.maxsize
+        self.__pending_full = False
+        self.__pending_dropped = 0
+        # notifications to be sent to the helper process, if it is used
+        self.__pending_notifications = []
+        self.__helpers = []
+        # ring of the helpers the hosts are distributed to and the values and
+        # notifications taken for each helper, if there are more helpers
+        self.__helper_ring = None
+        self.__helper_pending = []
+        # configuration entries as given, to configure the helper process
+        self.__config_entries = []
+        # filter of the written values, None if all are accepted
+        self.__value_filter = None
+        # self-telemetry: number, total latency and total lock wait of write
+        # callbacks since the last read, build time and lock wait of the last
+        # timer tick (the wait for the written values), the bytes sent and
+        # send latency are counted by the endpoints
+        self.__write_stats = [0, 0.0, 0.0]
+        self.__tick_stats = [0.0, 0.0]
+
+    def new_plugin_data_cache(self):
+        """Make plugin caches of a partition"""
+        return {
+            'cpu' : PluginCache(),
+            'virt' : PluginCache(aggregate_types=[x[0] for x in self.DISK_TYPES]),
+            'disk' : PluginCache(aggregate_types=[x[0] for x in self.HOST_DISK_TYPES
+                                                  if x[0] not in self.HOST_DISK_GAUGES]),
+            'interface' : PluginCache(),
+            'memory' : PluginCache()
+        }
 
     def get_event_id(self):
         """get event id"""
@@ -560,170 +2048,551 @@ class VESPlugin(object):
 
     def start_timer(self):
         """Start event timer"""
-        self.__ves_timer = Timer(self.__plugin_config['SendEventInterval'], self.__on_time)
+        self.__ves_timer = IntervalScheduler(self.__plugin_config['SendEventInterval'],
+            self.event_timer,
+            catch_up=(self.__plugin_config['TickOverrunPolicy'] == 'catch-up'))
         self.__ves_timer.start()
 
-    def stop_timer(self):
-        """Stop event timer"""
-        self.__ves_timer.cancel()
-
-    def __on_time(self):
-        """Timer thread"""
-        self.event_timer()
-        self.start_timer()
+    def stop_timer(self, timeout=None):
+        """Stop event timer and wait for the running tick until timeout expires"""
+        self.__ves_timer.stop(timeout)
+
+    def http_post(self, path, body, endpoint=None):
+        """Post the body to VES, return True on success, False on failure
+        and None if the listener is not available and the body can be resent.
+        If endpoint is not given, the body is posted to the first available
+        endpoint in the order of preference (failover)"""
+        if self.__plugin_config['Debug']:
+            collectd.debug("Sending {} to {}".format(body, path))
+        headers = self.__http_headers
+        if self.__compress is not None and \
+                len(body) >= self.__plugin_config['CompressionMinBytes']:
+            body = self.__compress(body)
+            headers = self.__compressed_http_headers
+        if endpoint is not None:
+            return self.post(endpoint, path, body, headers)
+        for endpoint in self.__endpoints:
+            if endpoint.health.delay() > 0.0:
+                continue
+            if endpoint is not self.__active_endpoint:
+                collectd.info('Vendor Event Listener {} is used'.format(endpoint.root))
+                self.__active_endpoint = endpoint
+            result = self.post(endpoint, path, body, headers)
+            if result is not None:
+                return result
+        return None
+
+    def post(self, endpoint, path, body, headers):
+        """Post the body to the endpoint and record the result in its health,
+        return the same as http_post()"""
+        try:
+            start = time.time()
+            response = endpoint.pool.request('POST', path, body, headers)
+            if self.__plugin_config['SelfTelemetry']:
+                endpoint.sent_bytes += len(body)
+                endpoint.latency[bisect.bisect_left(
+                    self.HTTP_LATENCY_BUCKETS, time.time() - start)] += 1
+        except (socket.error, httplib.HTTPException) as e:
+            collectd.error('Vendor Event Listener {} is is not reachable: {}'.format(
+                endpoint.root, e))
+            endpoint.health.failure()
+            return None
+        except:
+            collectd.error('Vendor Event Listener unknown error')
+            return False
+        if response.status // 100 != 2:
+            collectd.error('Vendor Event Listener {} exception: HTTP Error {}: {}'.format(
+                endpoint.root, response.status, response.reason))
+            if response.status == 429 or response.status // 100 == 5:
+                endpoint.health.failure(EndpointHealth.parse_retry_after(
+                    response.getheader('Retry-After')))
+                return None
+            # the listener is available, it just rejects the event
+            endpoint.health.success()
+            return False
+        endpoint.health.success()
+        if self.__plugin_config['Debug']:
+            collectd.debug("Sent data to {}{} successfully".format(endpoint.root, path))
+        return True
+
+    def get_sender(self, source_id):
+        """Get sender of the events of the source"""
+        if self.__ring is None:
+            return self.__senders[0]
+        return self.__senders[self.__ring.get(source_id)]
 
     def event_send(self, event):
-        """Send event to VES"""
-        server_url = "http{}://{}:{}{}/eventListener/v{}{}".format(
-            's' if self.__plugin_config['UseHttps'] else '', self.__plugin_config['Domain'],
-            int(self.__plugin_config['Port']), '{}'.format(
-            '/{}'.format(self.__plugin_config['Path']) if (len(self.__plugin_config['Path']) > 0) else ''),
+        """Queue event to be sent to VES"""
+        self.get_sender(event.source_id).put(self.__server_path,
+                                              event.get_json(self.__json_dumps))
+
+    def events_send(self, events):
+        """Queue list of events to be sent to VES, each to the sender of its
+        source if the events are sharded"""
+        if self.__ring is None:
+            self.requests_send(self.__senders[0], events)
+            return
+        shards = {}
+        for event in events:
+            shards.setdefault(self.__ring.get(event.source_id), []).append(event)
+        for index in sorted(shards):
+            self.requests_send(self.__senders[index], shards[index])
+
+    def requests_send(self, sender, events):
+        """Queue list of events to the sender, in batches if batching is
+        enabled and spread over the send interval if pacing is enabled"""
+        requests = self.make_requests(events)
+        if not self.__plugin_config['Pacing']:
+            for path, body, count in requests:
+                sender.put(path, body, count)
+            return
+        # send the requests in evenly spaced slots, at the host phase offset
+        # within the slot, so the listener is not hit by a burst of requests
+        # from all hosts at the same time
+        start = time.time()
+        slot = self.__plugin_config['SendEventInterval'] / max(len(requests), 1)
+        for index, (path, body, count) in enumerate(requests):
+            sender.put(path, body, count,
+                              due=start + (self.__pacing_phase + index) * slot)
+
+    def make_requests(self, events):
+        """Make list of (path, body, number of events) requests from the
+        events, each event in its own request or in batches if enabled"""
+        batch_size = int(self.__plugin_config['BatchSize'])
+        if batch_size <= 1:
+            return [(self.__server_path, event.get_json(self.__json_dumps), 1)
+                    for event in events]
+        requests = []
+        max_bytes = int(self.__plugin_config['BatchMaxBytes'])
+        overhead = len(self.batch_body([]))
+        batch = []
+        batch_bytes = overhead
+        for event in events:
+            item = event.encode(self.__json_dumps)
+            # an event bigger than BatchMaxBytes is still sent in its own batch
+            if len(batch) and (len(batch) >= batch_size or (max_bytes > 0 and
+                    batch_bytes + len(item) + 1 > max_bytes)):
+                requests.append((self.__batch_path, self.batch_body(batch), len(batch)))
+                batch = []
+                batch_bytes = overhead
+            batch.append(item)
+            batch_bytes += len(item) + 1
+        if len(batch):
+            requests.append((self.__batch_path, self.batch_body(batch), len(batch)))
+        return requests
+
+    def replay_batch(self, requests):
+        """Make one batch request of the leading single event requests of the
+        spooled requests, within BatchMaxBytes. Return (path, body, number of
+        events, number of requests), the first request as it is if it cannot
+        be batched"""
+        prefix = b'{"event": '
+        max_bytes = int(self.__plugin_config['BatchMaxBytes'])
+        items = []
+        batch_bytes = len(self.batch_body([]))
+        for path, body, count in requests:
+            if path != self.__server_path or not body.startswith(prefix):
+                break
+            # the body of single event request is the event in an object
+            item = body[len(prefix):-1]
+            if len(items) and max_bytes > 0 and batch_bytes + len(item) + 1 > max_bytes:
+                break
+            items.append(item)
+            batch_bytes += len(item) + 1
+        if len(items) < 2:
+            path, body, count = requests[0]
+            return path, body, count, 1
+        return self.__batch_path, self.batch_body(items), len(items), len(items)
+
+    def batch_body(self, items):
+        """Make 'eventList' request body from list of JSON encoded events"""
+        return b'{"eventList": [' + b','.join(items) + b']}'
+
+    def init_connection(self):
+        """Prepare VES listener URL, headers and connection pool"""
+        self.__server_path = "{}/eventListener/v{}{}".format(
+            '/{}'.format(self.__plugin_config['Path']) if (len(self.__plugin_config['Path']) > 0) else '',
             int(self.__plugin_config['ApiVersion']), '{}'.format(
             '/{}'.format(self.__plugin_config['Topic']) if (len(self.__plugin_config['Topic']) > 0) else ''))
-        collectd.info('Vendor Event Listener is at: {}'.format(server_url))
+        self.__batch_path = "{}/eventListener/v{}/eventBatch".format(
+            '/{}'.format(self.__plugin_config['Path']) if (len(self.__plugin_config['Path']) > 0) else '',
+            int(self.__plugin_config['ApiVersion']))
         credentials = base64.b64encode('{}:{}'.format(
             self.__plugin_config['Username'], self.__plugin_config['Password']).encode()).decode()
         collectd.info('Authentication credentials are: {}'.format(credentials))
-        try:
-            request = url.Request(server_url)
-            request.add_header('Authorization', 'Basic {}'.format(credentials))
-            request.add_header('Content-Type', 'application/json')
-            collectd.debug("Sending {} to {}".format(event.get_json(), server_url))
-            vel = url.urlopen(request, event.get_json(), timeout=1)
-            collectd.debug("Sent data to {} successfully".format(server_url))
-        except url.HTTPError as e:
-            collectd.error('Vendor Event Listener exception: {}'.format(e))
-        except url.URLError as e:
-            collectd.error('Vendor Event Listener is is not reachable: {}'.format(e))
-        except:
-            collectd.error('Vendor Event Listener unknown error')
+        self.__http_headers = {
+            'Authorization' : 'Basic {}'.format(credentials),
+            'Content-Type' : 'application/json'
+        }
+        if self.__plugin_config['Compression'] != 'none':
+            self.__compress = compressors[self.__plugin_config['Compression']]
+            self.__compressed_http_headers = dict(self.__http_headers)
+            self.__compressed_http_headers['Content-Encoding'] = \
+                self.__plugin_config['Compression']
+        addresses = [self.parse_endpoint(endpoint) for endpoint
+                     in self.__plugin_config['Endpoints']]
+        if len(addresses) == 0:
+            addresses = [(self.__plugin_config['Domain'], int(self.__plugin_config['Port']))]
+        self.__endpoints = []
+        for host, port in addresses:
+            root = "http{}://{}:{}".format('s' if self.__plugin_config['UseHttps'] else '',
+                                           '[{}]'.format(host) if ':' in host else host, port)
+            collectd.info('Vendor Event Listener is at: {}{}'.format(root, self.__server_path))
+            self.__endpoints.append(ListenerEndpoint(root,
+                HTTPConnectionPool(host, port, use_https=self.__plugin_config['UseHttps'],
+                    size=int(self.__plugin_config['ConnectionPoolSize']),
+                    idle_timeout=self.__plugin_config['ConnectionIdleTimeout']),
+                EndpointHealth(root, backoff_min=self.__plugin_config['BackoffMin'],
+                    backoff_max=self.__plugin_config['BackoffMax'],
+                    threshold=int(self.__plugin_config['CircuitBreakerFailures'])),
+                len(self.HTTP_LATENCY_BUCKETS)))
+        self.__ring = None
+        if self.__plugin_config['EndpointMode'] == 'shard' and len(self.__endpoints) > 1:
+            self.__ring = HashRing([endpoint.root for endpoint in self.__endpoints])
+
+    def parse_endpoint(self, endpoint):
+        """Parse "host[:port]" endpoint (IPv6 address in brackets) to (host,
+        port), Port is used if the port is not given"""
+        port = int(self.__plugin_config['Port'])
+        if endpoint.startswith('['):
+            host, _, rest = endpoint[1:].partition(']')
+            if rest.startswith(':'):
+                port = int(rest[1:])
+            elif rest != '':
+                raise ValueError("invalid endpoint '{}'".format(endpoint))
+        elif endpoint.count(':') == 1:
+            host, _, port = endpoint.partition(':')
+            port = int(port)
+        else:
+            host = endpoint
+        if len(host) == 0:
+            raise ValueError("invalid endpoint '{}'".format(endpoint))
+        return host, port
 
     def bytes_to_kb(self, bytes):
         """Convert bytes to kibibytes"""
         return round((bytes / 1024.0), 3)
 
-    def get_hostname(self):
+    def get_hostname(self, host=None):
+        """Get name of the host reporting the events, host is the host of the
+        values or the notification, used if they are partitioned by host"""
+        if host is not None and self.__plugin_config['PartitionByHost']:
+            return host
         if len(self.__host_name):
             return self.__host_name
         return socket.gethostname()
 
-    def send_host_measurements(self):
+    def build_host_measurements(self):
+        """Build measurement events of all VMs"""
+        virt_cache = self.__plugin_data_cache['virt']
         # get list of all VMs
-        virt_vcpu_total = self.cache_get_value(plugin_name='virt', type_name='virt_cpu_total',
-                                               mark_as_read=False)
-        vm_names = [x['plugin_instance'] for x in virt_vcpu_total]
-        for vm_name in vm_names:
+        virt_vcpu_total = virt_cache.get(type_name='virt_cpu_total')
+        vms = []
+        for vm_total in virt_vcpu_total:
+            vm_name = vm_total['plugin_instance']
+            # group the VM values by type and by type instance in one pass and
             # make sure that 'virt' plugin cache is up-to-date
-            vm_values = self.cache_get_value(plugin_name='virt', plugin_instance=vm_name,
-                                             mark_as_read=False)
+            vm_types = {}
+            vm_values = {}
             us_up_to_date = True
-            for vm_value in vm_values:
-                if vm_value['updated'] == False:
+            for vm_value in virt_cache.get(plugin_instance=vm_name):
+                if not virt_cache.updated[vm_value.sid]:
                     us_up_to_date = False
                     break
+                _, type_name, type_instance = virt_cache.keys[vm_value.sid]
+                vm_types.setdefault(type_name, []).append(vm_value)
+                vm_values[(type_name, type_instance)] = vm_value
             if not us_up_to_date:
                     # one of the cache value is not up-to-date, break
                     collectd.warning("virt collectD cache values are not up-to-date for {}".format(vm_name))
                     continue
-            # values are up-to-date, create an event message
-            measurement = MeasurementsForVfScaling(self.get_event_id())
-            measurement.functional_role = self.__plugin_config['FunctionalRole']
-            # fill out reporting_entity
-            measurement.reporting_entity_id = self.get_hostname()
-            measurement.reporting_entity_name = measurement.reporting_entity_id
-            # set source as a host value
-            measurement.source_id = vm_name
-            measurement.source_name = measurement.source_id
-            # fill out EpochMicrosec (convert to us)
-            measurement.start_epoch_microsec = (virt_vcpu_total[0]['time'] * 1000000)
-            # plugin interval
-            measurement.measurement_interval = self.__plugin_data_cache['virt']['interval']
-            # memoryUsage
-            mem_usage = MemoryUsage(vm_name)
-            memory_total = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                type_name='memory', type_instance='total')
-            memory_unused = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                              type_name='memory', type_instance='unused')
-            memory_rss = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                              type_name='memory', type_instance='rss')
-            if len(memory_total) > 0:
-                mem_usage.memory_configured = self.bytes_to_kb(memory_total[0]['values'][0])
-            if len(memory_unused) > 0:
-                mem_usage.memory_free = self.bytes_to_kb(memory_unused[0]['values'][0])
-            elif len(memory_rss) > 0:
-                mem_usage.memory_free = self.bytes_to_kb(memory_rss[0]['values'][0])
-            # since, "used" metric is not provided by virt plugn, set the rest of the memory stats
-            # to zero to calculate used based on provided stats only
-            mem_usage.memory_buffered = mem_usage.memory_cached = mem_usage.memory_slab_recl = \
-            mem_usage.memory_slab_unrecl = 0
-            measurement.add_memory_usage(mem_usage)
-            # cpuUsage
-            virt_vcpus = self.cache_get_value(plugin_instance=vm_name,
-                                              plugin_name='virt', type_name='virt_vcpu')
-            for virt_vcpu in virt_vcpus:
-                cpu_usage = CpuUsage(virt_vcpu['type_instance'])
-                cpu_usage.percent_usage = self.cpu_ns_to_percentage(virt_vcpu)
-                measurement.add_cpu_usage(cpu_usage)
-            # vNicPerformance
-            if_packets = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                              type_name='if_packets', mark_as_read=False)
-            if_names = [x['type_instance'] for x in if_packets]
-            for if_name in if_names:
-                if_packets = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                  type_name='if_packets', type_instance=if_name)
-                if_octets = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                  type_name='if_octets', type_instance=if_name)
-                if_errors = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                  type_name='if_errors', type_instance=if_name)
-                if_dropped = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                  type_name='if_dropped', type_instance=if_name)
-                v_nic_performance = VNicPerformance(if_name)
-                v_nic_performance.received_total_packets_accumulated = if_packets[0]['values'][0]
-                v_nic_performance.transmitted_total_packets_accumulated = if_packets[0]['values'][1]
-                v_nic_performance.received_octets_accumulated = if_octets[0]['values'][0]
-                v_nic_performance.transmitted_octets_accumulated = if_octets[0]['values'][1]
-                v_nic_performance.received_error_packets_accumulated = if_errors[0]['values'][0]
-                v_nic_performance.transmitted_error_packets_accumulated = if_errors[0]['values'][1]
-                v_nic_performance.received_discarded_packets_accumulated = if_dropped[0]['values'][0]
-                v_nic_performance.transmitted_discarded_packets_accumulated = if_dropped[0]['values'][1]
-                measurement.add_v_nic_performance(v_nic_performance)
-            # diskUsage
-            disk_octets = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                               type_name='disk_octets', mark_as_read=False)
-            disk_names = [x['type_instance'] for x in disk_octets]
-            for disk_name in disk_names:
-                disk_octets = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                   type_name='disk_octets', type_instance=disk_name)
-                disk_ops = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                                   type_name='disk_ops', type_instance=disk_name)
-                disk_usage = DiskUsage(disk_name)
-                disk_usage.disk_octets_read_last = disk_octets[0]['values'][0]
-                disk_usage.disk_octets_write_last = disk_octets[0]['values'][1]
-                disk_usage.disk_ops_read_last = disk_ops[0]['values'][0]
-                disk_usage.disk_ops_write_last = disk_ops[0]['values'][1]
-                measurement.add_disk_usage(disk_usage)
-            # add additional measurements (perf)
-            perf_values = self.cache_get_value(plugin_instance=vm_name, plugin_name='virt',
-                                               type_name='perf')
-            named_array = NamedArrayOfFields('perf')
-            for perf in perf_values:
-                named_array.add(Field(perf['type_instance'], str(perf['values'][0])))
-            measurement.add_additional_measurement(named_array)
-            # add host values as additional measurements
-            self.set_additional_fields(measurement, exclude_plugins=['virt'])
-            # send event to the VES
-            self.event_send(measurement)
-        if len(vm_names) > 0:
+            vms.append((vm_total, vm_types, vm_values))
+        # the CPU usage and vNIC deltas of all VMs are computed at once over
+        # the cache columns, by series id
+        vcpus = [val for _, vm_types, _ in vms for val in vm_types.get('virt_vcpu', [])]
+        v_nics = [vm_values[(type_name, if_packets['type_instance'])]
+                  for _, vm_types, vm_values in vms
+                  for if_packets in vm_types.get('if_packets', [])
+                  for type_name, _ in self.V_NIC_TYPES
+                  if (type_name, if_packets['type_instance']) in vm_values]
+        derived = dict(zip([val.sid for val in vcpus],
+                           self.cpu_ns_to_percentage(virt_cache, vcpus)))
+        derived.update(zip([val.sid for val in v_nics], virt_cache.deltas(v_nics)))
+        # the host values are the same in all VM events
+        host_fields = None
+        if self.__plugin_config['HostFieldsInVmEvents'] and len(vms):
+            host_fields = self.get_additional_fields(exclude_plugins=['virt'])
+        # values are up-to-date, create the event messages
+        events = [self.build_vm_measurement(vm_total, vm_types, vm_values,
+                                            virt_cache.interval, derived, host_fields)
+                  for vm_total, vm_types, vm_values in vms]
+        if self.__plugin_config['SendHostEvent']:
+            host_event = self.build_host_measurement()
+            if host_event is not None:
+                events.append(host_event)
+            self.mark_cache_values_as_read(exclude_plugins=['virt'])
+        elif len(virt_vcpu_total) > 0:
           # mark the additional measurements metrics as read
           self.mark_cache_values_as_read(exclude_plugins=['virt'])
+        return events
+
+    def build_host_measurement(self):
+        """Build measurement event of the host from the updated values of
+        all plugins but virt, return None if there are none. The values of
+        cpu, memory, interface and disk plugins are set in the typed arrays,
+        the rest as additional fields"""
+        values = [(plugin_name, val) for plugin_name, cache in self.__plugin_data_cache.items()
+                  if plugin_name != 'virt' for val in cache.vls if val['updated']]
+        if len(values) == 0:
+            return None
+        measurement = MeasurementsForVfScaling(self.get_event_id())
+        measurement.functional_role = self.__plugin_config['FunctionalRole']
+        # fill out reporting_entity and source
+        measurement.reporting_entity_id = self.get_hostname(self.__partition_host)
+        measurement.reporting_entity_name = measurement.reporting_entity_id
+        measurement.source_id = measurement.reporting_entity_id
+        measurement.source_name = measurement.source_id
+        # fill out EpochMicrosec (convert to us) and interval
+        measurement.start_epoch_microsec = max(val['time'] for _, val in values) * 1000000
+        measurement.measurement_interval = self.__plugin_data_cache[values[0][0]].interval
+        v_nic_types = dict(self.V_NIC_TYPES)
+        disk_types = dict(self.HOST_DISK_TYPES)
+        cpus = {}
+        memory = None
+        v_nics = {}
+        disks = {}
+        interface_values = [val for plugin_name, val in values
+                            if plugin_name == 'interface' and val['type'] in v_nic_types]
+        deltas = dict(zip([val.sid for val in interface_values],
+                          self.__plugin_data_cache['interface'].deltas(interface_values)))
+        for plugin_name, val in values:
+            # the device is the plugin instance or, in older collectd
+            # versions, the type instance
+            device = val['plugin_instance'] or val['type_instance']
+            if plugin_name == 'cpu' and val['type'] == 'percent' and \
+                    val['type_instance'] in self.HOST_CPU_STATES:
+                cpu = cpus.get(val['plugin_instance'])
+                if cpu is None:
+                    cpu = cpus[val['plugin_instance']] = CpuUsage(val['plugin_instance'] or 'total')
+                setattr(cpu, self.HOST_CPU_STATES[val['type_instance']], val['values'][0])
+            elif plugin_name == 'memory' and val['type'] == 'memory' and \
+                    val['type_instance'] in self.HOST_MEMORY_TYPES:
+                if memory is None:
+                    memory = MemoryUsage(measurement.reporting_entity_id)
+                setattr(memory, self.HOST_MEMORY_TYPES[val['type_instance']],
+                        self.bytes_to_kb(val['values'][0]))
+            elif plugin_name == 'interface' and val['type'] in v_nic_types:
+                v_nic = v_nics.get(device)
+                if v_nic is None:
+                    v_nic = v_nics[device] = VNicPerformance(device)
+                attrs = v_nic_types[val['type']]
+                self.set_fields(v_nic, attrs, '_accumulated', val)
+                self.set_deltas(v_nic, attrs, deltas[val.sid])
+            elif plugin_name == 'disk' and val['type'] in disk_types:
+                disk = disks.get(device)
+                if disk is None:
+                    disk = disks[device] = DiskUsage(device)
+                if val['type'] in self.HOST_DISK_GAUGES:
+                    self.set_fields(disk, disk_types[val['type']], '_last', val)
+                else:
+                    self.set_aggregates(disk, disk_types[val['type']], val)
+            else:
+                continue
+            val['updated'] = False
+        for name in sorted(cpus):
+            cpu = cpus[name]
+            if cpu.cpu_idle is not None:
+                cpu.percent_usage = round(100.0 - cpu.cpu_idle, 2)
+            measurement.add_cpu_usage(cpu)
+        if memory is not None:
+            memory.memory_configured = memory.get_memory_total()
+            measurement.add_memory_usage(memory)
+        for name in sorted(v_nics):
+            measurement.add_v_nic_performance(v_nics[name])
+        for name in sorted(disks):
+            measurement.add_disk_usage(disks[name])
+        # add the rest of host values as additional fields
+        self.set_additional_fields(measurement, exclude_plugins=['virt'])
+        return measurement
+
+    def build_vm_measurement(self, vm_total, vm_types, vm_values, interval, derived,
+                             host_fields=None):
+        """Build measurement event of one VM from its values grouped by type
+        and by (type, type_instance), the values derived from them by series
+        id and the host additional fields, mark the used values as read"""
+        vm_name = vm_total['plugin_instance']
+        measurement = MeasurementsForVfScaling(self.get_event_id())
+        measurement.functional_role = self.__plugin_config['FunctionalRole']
+        # fill out reporting_entity
+        measurement.reporting_entity_id = self.get_hostname(self.__partition_host)
+        measurement.reporting_entity_name = measurement.reporting_entity_id
+        # set source as a host value
+        measurement.source_id = vm_name
+        measurement.source_name = measurement.source_id
+        # fill out EpochMicrosec (convert to us)
+        measurement.start_epoch_microsec = (vm_total['time'] * 1000000)
+        # plugin interval
+        measurement.measurement_interval = interval
+        # memoryUsage
+        mem_usage = MemoryUsage(vm_name)
+        memory_total = vm_values.get(('memory', 'total'))
+        memory_unused = vm_values.get(('memory', 'unused'))
+        memory_rss = vm_values.get(('memory', 'rss'))
+        if memory_total is not None:
+            mem_usage.memory_configured = self.bytes_to_kb(memory_total['values'][0])
+        if memory_unused is not None:
+            mem_usage.memory_free = self.bytes_to_kb(memory_unused['values'][0])
+        elif memory_rss is not None:
+            mem_usage.memory_free = self.bytes_to_kb(memory_rss['values'][0])
+        for val in (memory_total, memory_unused, memory_rss):
+            if val is not None:
+                val['updated'] = False
+        # since, "used" metric is not provided by virt plugn, set the rest of the memory stats
+        # to zero to calculate used based on provided stats only
+        mem_usage.memory_buffered = mem_usage.memory_cached = mem_usage.memory_slab_recl = \
+        mem_usage.memory_slab_unrecl = 0
+        measurement.add_memory_usage(mem_usage)
+        # cpuUsage
+        for virt_vcpu in vm_types.get('virt_vcpu', []):
+            cpu_usage = CpuUsage(virt_vcpu['type_instance'])
+            cpu_usage.percent_usage = derived[virt_vcpu.sid]
+            measurement.add_cpu_usage(cpu_usage)
+            virt_vcpu['updated'] = False
+        # vNicPerformance
+        for if_packets in vm_types.get('if_packets', []):
+            if_name = if_packets['type_instance']
+            v_nic_performance = VNicPerformance(if_name)
+            for type_name, attrs in self.V_NIC_TYPES:
+                val = vm_values.get((type_name, if_name))
+                if val is not None:
+                    self.set_fields(v_nic_performance, attrs, '_accumulated', val)
+                    self.set_deltas(v_nic_performance, attrs, derived[val.sid])
+                    val['updated'] = False
+            measurement.add_v_nic_performance(v_nic_performance)
+        # diskUsage
+        for disk_octets in vm_types.get('disk_octets', []):
+            disk_name = disk_octets['type_instance']
+            disk_usage = DiskUsage(disk_name)
+            for type_name, attrs in self.DISK_TYPES:
+                val = vm_values.get((type_name, disk_name))
+                if val is not None:
+                    self.set_aggregates(disk_usage, attrs, val)
+                    val['updated'] = False
+            measurement.add_disk_usage(disk_usage)
+        # add additional measurements (perf)
+        named_array = NamedArrayOfFields('perf')
+        for perf in vm_types.get('perf', []):
+            named_array.add(Field(perf['type_instance'], str(perf['values'][0])))
+            perf['updated'] = False
+        measurement.add_additional_measurement(named_array)
+        # add host values as additional measurements
+        if host_fields is not None:
+            self.set_additional_fields(measurement, fields=host_fields)
+        return measurement
+
+    def set_fields(self, datatype, attrs, suffix, val):
+        """Set datatype attributes (name + suffix) to the cached values"""
+        for attr, value in zip(attrs, val['values']):
+            setattr(datatype, attr + suffix, value)
+
+    def set_deltas(self, datatype, attrs, deltas):
+        """Set datatype delta attributes to the change of the cached values
+        since the previous event was built, see PluginCache.deltas()"""
+        if deltas is None:
+            return
+        for index, attr in enumerate(attrs):
+            delta = deltas[index]
+            if delta >= 0:
+                # negative delta means the counter has been reset
+                setattr(datatype, attr + '_delta', delta)
+
+    def set_aggregates(self, datatype, attrs, val):
+        """Set datatype avg/min/max/last attributes to the aggregates of the
+        rates of the cached values since the previous event was built"""
+        aggregate = val['aggregate']
+        if aggregate is None or aggregate.count == 0:
+            return
+        for index, attr in enumerate(attrs):
+            setattr(datatype, attr + '_last', aggregate.last[index])
+            setattr(datatype, attr + '_avg', aggregate.avg(index))
+            setattr(datatype, attr + '_min', aggregate.min[index])
+            setattr(datatype, attr + '_max', aggregate.max[index])
+        aggregate.reset()
 
     def event_timer(self):
         """Event timer thread"""
         self.lock()
         try:
-            self.send_host_measurements()
+            start = time.time()
+            lock_wait = self.update_cache_values()
+            self.evict_stale_values()
+            events = self.build_partition_measurements()
+            self.__tick_stats = [time.time() - start, lock_wait]
         finally:
             self.unlock()
+        # encode and queue the events outside of the lock
+        self.events_send(events)
+
+    ##
+    # Please note, the cache should be locked before using this function
+    #
+    def build_partition_measurements(self):
+        """Build measurement events of each host partition in turn"""
+        events = []
+        try:
+            for host in sorted(self.__partitions, key=lambda x: x or ''):
+                self.__plugin_data_cache = self.__partitions[host]
+                self.__partition_host = host
+                events.extend(self.build_host_measurements())
+        finally:
+            self.__plugin_data_cache = self.__partitions.get(None, {})
+            self.__partition_host = None
+        return events
+
+    ##
+    # Please note, the cache should be locked before using this function
+    #
+    def evict_stale_values(self):
+        """Remove values of the series which are not updated any more
+        (e.g. of deleted VMs) from the cache"""
+        ttl_intervals = self.__plugin_config['CacheTTLIntervals']
+        if ttl_intervals <= 0:
+            return
+        evicted = 0
+        # time of the newest value of each plugin in all partitions
+        last_times = {}
+        for caches in self.__partitions.values():
+            for plugin_name, cache in caches.items():
+                last_times[plugin_name] = max(last_times.get(plugin_name, 0.0), cache.last_time)
+        for host, caches in list(self.__partitions.items()):
+            for plugin_name, cache in caches.items():
+                if cache.interval > 0:
+                    evicted += cache.evict(ttl_intervals * cache.interval,
+                                           last_times[plugin_name])
+            if host is not None and not any(len(cache) for cache in caches.values()):
+                # the host does not report any more
+                del self.__partitions[host]
+                collectd.info('VES cache: host {} removed'.format(host))
+        if evicted > 0:
+            self.__cache_entries -= evicted
+            self.cache_evictions['ttl'] += evicted
+            collectd.info('VES cache: {} stale values evicted'.format(evicted))
+
+    ##
+    # Please note, the cache should be locked before using this function
+    #
+    def evict_least_recently_updated(self, count):
+        """Remove count least recently updated values from the cache"""
+        oldest = heapq.nsmallest(count, ((cache, val) for caches in self.__partitions.values()
+                                         for cache in caches.values() for val in cache.vls),
+                                 key=lambda x: x[1]['time'])
+        by_cache = {}
+        for cache, val in oldest:
+            by_cache.setdefault(id(cache), (cache, []))[1].append(val)
+        for cache, vals in by_cache.values():
+            cache.remove(vals)
+        self.__cache_entries -= len(oldest)
+        self.cache_evictions['lru'] += len(oldest)
 
     def mark_cache_values_as_read(self, exclude_plugins=None):
         """mark the cache values as read"""
@@ -731,8 +2600,30 @@ class VESPlugin(object):
             if (exclude_plugins != None and plugin_name in exclude_plugins):
                 # skip excluded plugins
                 continue;
-            for val in self.__plugin_data_cache[plugin_name]['vls']:
-                val['updated'] = False
+            self.__plugin_data_cache[plugin_name].mark_read()
+
+    def get_dataset(self, type_name):
+        """Get data source descriptor of the type: data source names, names of
+        the values in additional measurements ('type-ds') and suffixes of the
+        additional field names. collectd.get_dataset() is called once per type"""
+        dataset = self.__datasets.get(type_name)
+        if dataset is None:
+            names = [ds[0] for ds in collectd.get_dataset(type_name)]
+            dataset = {
+                'names' : names,
+                'measurement_names' : ['{}-{}'.format(type_name, name) for name in names],
+                'field_suffixes' : [self.make_dash_string(type_name, name) for name in names]
+            }
+            self.__datasets[type_name] = dataset
+        return dataset
+
+    def reset_datasets(self):
+        """Drop data source descriptors and the names made from them"""
+        self.__datasets = {}
+        for caches in self.__partitions.values():
+            for cache in caches.values():
+                for val in cache.vls:
+                    val['field_names'] = None
 
     def set_additional_measurements(self, measurement, exclude_plugins=None):
         """Set addition measurement filed with host/guets values"""
@@ -741,46 +2632,58 @@ class VESPlugin(object):
             if (exclude_plugins != None and plugin_name in exclude_plugins):
                 # skip excluded plugins
                 continue;
-            for val in self.__plugin_data_cache[plugin_name]['vls']:
+            for val in self.__plugin_data_cache[plugin_name].vls:
                 if val['updated']:
                     array_name = self.make_dash_string(plugin_name, val['plugin_instance'],
                                                        val['type_instance'])
                     named_array = NamedArrayOfFields(array_name)
-                    ds = collectd.get_dataset(val['type'])
-                    for index in range(len(ds)):
-                        mname = '{}-{}'.format(val['type'], ds[index][0])
-                        named_array.add(Field(mname, str(val['values'][index])))
+                    mnames = self.get_dataset(val['type'])['measurement_names']
+                    for index in range(len(mnames)):
+                        named_array.add(Field(mnames[index], str(val['values'][index])))
                     measurement.add_additional_measurement(named_array);
                     val['updated'] = False
 
-    def set_additional_fields(self, measurement, exclude_plugins=None):
-        # set host values as additional fields
+    def set_additional_fields(self, measurement, exclude_plugins=None, fields=None):
+        """Set host values as additional fields, fields are the additional
+        fields got by get_additional_fields() if they are shared by events"""
+        if fields is None:
+            fields = self.get_additional_fields(exclude_plugins)
+        for name, value in fields:
+            measurement.add_additional_fields(Field(name, value))
+
+    def get_additional_fields(self, exclude_plugins=None):
+        """Get (name, value) of the additional fields of the updated values"""
+        fields = []
         for plugin_name in self.__plugin_data_cache.keys():
             if (exclude_plugins != None and plugin_name in exclude_plugins):
                 # skip excluded plugins
                 continue;
-            for val in self.__plugin_data_cache[plugin_name]['vls']:
-                if val['updated']:
-                    name_prefix = self.make_dash_string(plugin_name, val['plugin_instance'],
-                                                        val['type_instance'])
-                    ds = collectd.get_dataset(val['type'])
-                    for index in range(len(ds)):
-                        field_name = self.make_dash_string(name_prefix, val['type'], ds[index][0])
-                        measurement.add_additional_fields(Field(field_name, str(val['values'][index])))
-
-    def cpu_ns_to_percentage(self, vl):
-        """Convert CPU usage ns to CPU %"""
-        total = vl['values'][0]
-        total_time = vl['time']
-        pre_total = vl['pre_values'][0]
-        pre_total_time = vl['pre_time']
-        if (total_time - pre_total_time) == 0:
-            # return zero usage if time diff is zero
-            return 0.0
-        percent = (100.0 * (total - pre_total))/((total_time - pre_total_time) * 1000000000.0)
-        collectd.debug("pre_time={}, pre_value={}, time={}, value={}, cpu={}%".format(
-            pre_total_time, pre_total, total_time, total, round(percent, 2)))
-        return round(percent, 2)
+            cache = self.__plugin_data_cache[plugin_name]
+            updated = cache.updated
+            for sid, val in enumerate(cache.vls):
+                if updated[sid]:
+                    field_names = val.field_names
+                    if field_names is None:
+                        plugin_instance, type_name, type_instance = cache.keys[sid]
+                        name_prefix = self.make_dash_string(plugin_name, plugin_instance,
+                                                            type_instance)
+                        field_names = val.field_names = [
+                            self.make_dash_string(name_prefix, suffix) for suffix
+                            in self.get_dataset(type_name)['field_suffixes']]
+                    for name, value in zip(field_names, cache.get_values(sid)):
+                        fields.append((name, str(value)))
+        return fields
+
+    def cpu_ns_to_percentage(self, cache, vls):
+        """Convert CPU usage ns of the cache records to CPU %, zero usage is
+        returned if the time diff is zero"""
+        percents = [round(percent, 2) for percent
+                    in cache.rates(vls, scale=100.0, unit=1000000000.0)]
+        if self.__plugin_config['Debug']:
+            for vl, percent in zip(vls, percents):
+                collectd.debug("pre_time={}, pre_value={}, time={}, value={}, cpu={}%".format(
+                    vl['pre_time'], vl['pre_values'][0], vl['time'], vl['values'][0], percent))
+        return percents
 
     def make_dash_string(self, *args):
         """Join non empty strings with dash symbol"""
@@ -788,105 +2691,397 @@ class VESPlugin(object):
 
     def config(self, config):
         """Collectd config callback"""
+        # types may have been redefined, so get their data sets again
+        self.reset_datasets()
         for child in config.children:
+            self.__config_entries.append((child.key, list(child.values)))
             # check the config entry name
             if child.key not in self.__plugin_config:
                 collectd.error("Key '{}' name is invalid".format(child.key))
                 raise RuntimeError('Configuration key name error')
+            # list entries take all the values and can be repeated
+            if isinstance(self.__plugin_config[child.key], list):
+                if len(child.values) == 0 or any(type(x) != str for x in child.values):
+                    collectd.error("Key '{}' values should be strings".format(child.key))
+                    raise RuntimeError('Configuration key value error')
+                self.__plugin_config[child.key] = \
+                    self.__plugin_config[child.key] + list(child.values)
+                continue
             # check the config entry value type
             if len(child.values) == 0 or type(child.values[0]) != type(self.__plugin_config[child.key]):
                 collectd.error("Key '{}' value type '{}' should be {}".format(
                                child.key, str(type(child.values[0])),
                                str(type(self.__plugin_config[child.key]))))
                 raise RuntimeError('Configuration key value error')
+            if child.key == 'SendQueuePolicy' and child.values[0] not in ('drop', 'overwrite'):
+                collectd.error("Key '{}' value should be 'drop' or 'overwrite'".format(child.key))
+                raise RuntimeError('Configuration key value error')
+            if child.key == 'EndpointMode' and child.values[0] not in ('failover', 'shard'):
+                collectd.error("Key '{}' value should be 'failover' or 'shard'".format(child.key))
+                raise RuntimeError('Configuration key value error')
+            if child.key == 'TickOverrunPolicy' and child.values[0] not in ('skip', 'catch-up'):
+                collectd.error("Key '{}' value should be 'skip' or 'catch-up'".format(child.key))
+                raise RuntimeError('Configuration key value error')
+            if child.key == 'Compression' and child.values[0] != 'none' \
+                    and child.values[0] not in compressors:
+                collectd.error("Key '{}' value should be 'none', {}".format(
+                    child.key, ', '.join("'{}'".format(x) for x in sorted(compressors))))
+                raise RuntimeError('Configuration key value error')
             # store the value in configuration
             self.__plugin_config[child.key] = child.values[0]
+        for endpoint in self.__plugin_config['Endpoints']:
+            try:
+                self.parse_endpoint(endpoint)
+            except ValueError as e:
+                collectd.error("Key 'Endpoints' value error: {}".format(e))
+                raise RuntimeError('Configuration key value error')
+        # compile the value filter
+        self.__value_filter = None
+        if self.__plugin_config['Include'] or self.__plugin_config['Exclude']:
+            try:
+                self.__value_filter = ValueFilter(self.__plugin_config['Include'],
+                                                  self.__plugin_config['Exclude'])
+            except ValueError as e:
+                collectd.error("Key 'Include' or 'Exclude' value error: {}".format(e))
+                raise RuntimeError('Configuration key value error')
+        # the values of one host are processed by one helper
+        workers = self.__plugin_config['HelperWorkers']
+        if workers < 1 or (workers > 1 and not self.__plugin_config['PartitionByHost']):
+            collectd.error("Key 'HelperWorkers' value error: must be 1 or more, more than "
+                           "1 requires 'PartitionByHost'")
+            raise RuntimeError('Configuration key value error')
+        self.__pending_max = int(self.__plugin_config['WriteQueueSize']) or sys.maxsize
+        self.__partitions = {}
+        if not self.__plugin_config['PartitionByHost']:
+            self.__partitions[None] = self.__plugin_data_cache
+
+    def init_json_encoder(self):
+        """Select the JSON encoder of the events"""
+        name = self.__plugin_config['JsonEncoder']
+        if name == 'auto':
+            name = next(x for x in ('orjson', 'ujson', 'json') if x in json_encoders)
+        elif name not in json_encoders:
+            collectd.warning("JSON encoder '{}' is not available, using 'json'".format(name))
+            name = 'json'
+        collectd.info('VES events are encoded by {}'.format(name))
+        self.__json_dumps = json_encoders[name]
 
     def init(self):
         """Collectd init callback"""
+        if self.__plugin_config['HelperProcess']:
+            self.start_helper()
+            return
+        # select the JSON encoder
+        self.init_json_encoder()
+        # prepare the VES connection pool
+        self.init_connection()
+        # start the VES sender threads, one sending to the endpoints in the
+        # order of preference or one per endpoint if the events are sharded
+        spool_path = self.__plugin_config['SpoolPath']
+        if self.__ring is None:
+            health = self.__endpoints[0].health if len(self.__endpoints) == 1 else \
+                FailoverHealth([endpoint.health for endpoint in self.__endpoints])
+            self.__senders = [self.start_sender(self.http_post, health, spool_path)]
+        else:
+            # each endpoint has its own spool in a subdirectory named by it
+            self.__senders = []
+            for endpoint in self.__endpoints:
+                endpoint_spool_path = spool_path
+                if len(spool_path) > 0:
+                    endpoint_spool_path = os.path.join(spool_path, re.sub(
+                        r'[^\w.-]', '_', endpoint.root.partition('://')[2]))
+                self.__senders.append(self.start_sender(
+                    functools.partial(self.http_post, endpoint=endpoint),
+                    endpoint.health, endpoint_spool_path))
         # start the VES timer
         self.start_timer()
+        # coalesce and rate limit the notifications
+        window = self.__plugin_config['NotificationWindow']
+        rate = self.__plugin_config['NotificationRate']
+        if window > 0 or rate > 0:
+            self.__notifications = NotificationAggregator(window, rate,
+                self.__plugin_config['NotificationBurst'])
+            # without coalescing, the notifications over the rate are
+            # collapsed and flushed every second
+            self.__notification_timer = IntervalScheduler(
+                window if window > 0 else 1.0, self.flush_notifications)
+            self.__notification_timer.start()
+
+    def start_helper(self):
+        """Start the helper process running this plugin with the same
+        configuration outside of collectd"""
+        interpreter = self.__plugin_config['HelperInterpreter']
+        if len(interpreter) == 0:
+            # in collectd the executable is collectd itself
+            interpreter = sys.executable if os.path.basename(
+                sys.executable or '').startswith('python') else \
+                'python{}'.format(sys.version_info[0])
+        path = os.path.abspath(__file__)
+        if path.endswith('.pyc'):
+            path = path[:-1]
+        # the values are filtered before they are sent to the helper
+        entries = [(key, values) for key, values in self.__config_entries
+                   if key not in ('HelperProcess', 'HelperInterpreter', 'HelperWorkers',
+                                  'Include', 'Exclude')]
+        constants = dict((name, getattr(collectd, name)) for name
+                         in ('NOTIF_FAILURE', 'NOTIF_WARNING', 'NOTIF_OKAY'))
+        workers = int(self.__plugin_config['HelperWorkers'])
+        if workers > 1:
+            # the hosts are distributed among the helpers, each of them has
+            # its own spool
+            self.__helper_ring = HashRing([str(index) for index in range(workers)])
+            self.__helper_pending = [([], []) for index in range(workers)]
+        for index in range(workers):
+            name = ''
+            helper_entries = entries
+            if workers > 1:
+                name = str(index)
+                helper_entries = [(key, [os.path.join(values[0], 'worker-' + name)]
+                                   if key == 'SpoolPath' and len(values[0]) else values)
+                                  for key, values in entries]
+            helper = HelperProcess([interpreter, path, '--helper'],
+                                   ('config', helper_entries, constants),
+                                   functools.partial(self.take_pending, index), name)
+            self.__helpers.append(helper)
+            helper.start()
+
+    def take_pending(self, index=0):
+        """Swap the current generation of written values and notifications
+        for empty ones, return the values and notifications of the host
+        partitions of the helper of the index"""
+        with self.__pending_lock:
+            values, self.__pending = self.__pending, []
+            self.__pending_full = False
+            notifications, self.__pending_notifications = self.__pending_notifications, []
+            if self.__helper_ring is not None:
+                ring = self.__helper_ring
+                for value in values:
+                    # the host is the first field of the written values
+                    self.__helper_pending[ring.get(value[0])][0].append(value)
+                for n in notifications:
+                    self.__helper_pending[ring.get(n.host)][1].append(n)
+                values, notifications = self.__helper_pending[index]
+                self.__helper_pending[index] = ([], [])
+        return values, notifications
+
+    def start_sender(self, send, health, spool_path):
+        """Open the spool of undelivered events (if path is not empty) and
+        start sender thread sending the events by send(path, body)"""
+        spool = None
+        if len(spool_path) > 0:
+            try:
+                spool = EventSpool(spool_path, int(self.__plugin_config['SpoolMaxBytes']))
+                collectd.info('VES spool at {} holds {} events'.format(spool_path, len(spool)))
+            except (IOError, OSError) as e:
+                collectd.error('VES spool is disabled, cannot open it: {}'.format(e))
+        sender = EventSender(send, int(self.__plugin_config['SendQueueSize']),
+            overwrite=(self.__plugin_config['SendQueuePolicy'] == 'overwrite'),
+            spool=spool, replay_rate=self.__plugin_config['SpoolReplayRate'],
+            health=health, batch=self.replay_batch,
+            batch_size=max(int(self.__plugin_config['SpoolReplayBatchSize']), 1))
+        sender.start()
+        return sender
+
+    ##
+    # Please note, the cache should be locked before using this function
+    #
+    def update_cache_values(self):
+        """Swap the current generation of written values for an empty one
+        and update the cache with the values, return the time (sec) waited
+        for the write callbacks to release the values"""
+        start = time.time()
+        with self.__pending_lock:
+            lock_wait = time.time() - start
+            pending, self.__pending = self.__pending, []
+            self.__pending_full = False
+        # a value failed to be cached does not stop the update, the errors
+        # are logged once per update
+        errors = 0
+        make = WrittenValues._make
+        for value in pending:
+            try:
+                self.update_cache_value(make(value))
+            except Exception:
+                if errors == 0:
+                    error = traceback.format_exc()
+                errors += 1
+        if errors:
+            collectd.error('VES plugin failed to cache {} written values: {}'.format(
+                errors, error))
+        return lock_wait
 
     ##
     # Please note, the cache should be locked before using this function
     #
     def update_cache_value(self, vl):
         """Update value internal collectD cache values or create new one"""
-        found = False
-        if vl.plugin not in self.__plugin_data_cache:
-             self.__plugin_data_cache[vl.plugin] = {'vls': []}
-        plugin_vl = self.__plugin_data_cache[vl.plugin]['vls']
-        for index in range(len(plugin_vl)):
-            # record found, so just update time the values
-            if (plugin_vl[index]['plugin_instance'] ==
-                vl.plugin_instance) and (plugin_vl[index]['type_instance'] ==
-                    vl.type_instance) and (plugin_vl[index]['type'] == vl.type):
-                plugin_vl[index]['pre_time'] = plugin_vl[index]['time']
-                plugin_vl[index]['time'] = vl.time
-                plugin_vl[index]['pre_values'] = plugin_vl[index]['values']
-                plugin_vl[index]['values'] = vl.values
-                plugin_vl[index]['updated'] = True
-                found = True
-                break
-        if not found:
-            value = {}
-            # create new cache record
-            value['plugin_instance'] = vl.plugin_instance
-            value['type_instance'] = vl.type_instance
-            value['values'] = vl.values
-            value['pre_values'] = vl.values
-            value['type'] = vl.type
-            value['time'] = vl.time
-            value['pre_time'] = vl.time
-            value['host'] = vl.host
-            value['updated'] = True
-            self.__plugin_data_cache[vl.plugin]['vls'].append(value)
-            # update plugin interval based on one received in the value
-            self.__plugin_data_cache[vl.plugin]['interval'] = vl.interval
-
-    def cache_get_value(self, plugin_name=None, plugin_instance=None,
-                        type_name=None, type_instance=None, type_names=None, mark_as_read=True):
-        """Get cache value by given criteria"""
-        ret_list = []
-        if plugin_name in self.__plugin_data_cache:
-            for val in self.__plugin_data_cache[plugin_name]['vls']:
-                #collectd.info("plugin={}, type={}, type_instance={}".format(
-                #    plugin_name, val['type'], val['type_instance']))
-                if (type_name == None or type_name == val['type']) and (plugin_instance == None
-                    or plugin_instance == val['plugin_instance']) and (type_instance == None
-                    or type_instance == val['type_instance']) and (type_names == None
-                    or val['type'] in type_names):
-                    if mark_as_read:
-                        val['updated'] = False
-                    ret_list.append(val)
-        return ret_list
+        host = vl.host if self.__plugin_config['PartitionByHost'] else None
+        caches = self.__partitions.get(host)
+        if caches is None:
+            caches = self.__partitions[host] = self.new_plugin_data_cache()
+        if vl.plugin not in caches:
+             caches[vl.plugin] = PluginCache()
+        if not caches[vl.plugin].update(vl):
+            return
+        self.__cache_entries += 1
+        max_entries = int(self.__plugin_config['CacheMaxEntries'])
+        if max_entries > 0 and self.__cache_entries > max_entries:
+            # evict a tenth of the cache at once, so the cost of finding the
+            # least recently updated values is amortized over many writes
+            self.evict_least_recently_updated(
+                self.__cache_entries - max_entries + max(max_entries // 10, 1))
 
     def write(self, vl, data=None):
         """Collectd write callback"""
-        self.lock()
-        try:
-            # Example of collectD Value format
-            # collectd.Values(type='cpu',type_instance='interrupt',
-            # plugin='cpu',plugin_instance='25',host='localhost',
-            # time=1476694097.022873,interval=10.0,values=[0])
-            if vl.plugin == 'ves_plugin':
-                # store the host name and unregister callback
-                self.__host_name = vl.host
+        # Example of collectD Value format
+        # collectd.Values(type='cpu',type_instance='interrupt',
+        # plugin='cpu',plugin_instance='25',host='localhost',
+        # time=1476694097.022873,interval=10.0,values=[0])
+        if vl.plugin == 'ves_plugin':
+            # store the host name and unregister callback unless it is
+            # needed for the self-telemetry, which writes its values here
+            # on each read, so the helpers are told only about a new name
+            if not self.__plugin_config['SelfTelemetry']:
                 collectd.unregister_read(self.read)
+            if vl.host != self.__host_name:
+                self.__host_name = vl.host
+                for helper in self.__helpers:
+                    helper.set_host(vl.host)
+            return
+        # drop the values filtered out, the decision is looked up by plugin
+        # and only the plugins filtered by type need the full check
+        value_filter = self.__value_filter
+        if value_filter is not None:
+            accepted = value_filter.plugins.get(vl.plugin)
+            if accepted is None:
+                accepted = value_filter.accept(vl)
+            if not accepted:
                 return
-            # update the cache values
-            self.update_cache_value(vl)
-        finally:
-            self.unlock()
+        # add the value to the current generation, the cache is updated from
+        # it by the timer thread, so the write never waits for event building
+        value = (vl.host, vl.plugin, vl.plugin_instance, vl.type, vl.type_instance,
+                 vl.time, vl.interval, vl.values)
+        if not self.__plugin_config['SelfTelemetry']:
+            with self.__pending_lock:
+                if len(self.__pending) < self.__pending_max:
+                    self.__pending.append(value)
+                else:
+                    self.drop_pending()
+            return
+        start = time.time()
+        with self.__pending_lock:
+            locked = time.time()
+            if len(self.__pending) < self.__pending_max:
+                self.__pending.append(value)
+            else:
+                self.drop_pending()
+            stats = self.__write_stats
+            stats[0] += 1
+            stats[1] += time.time() - start
+            stats[2] += locked - start
+
+    ##
+    # Please note, the pending lock should be held when using this function
+    #
+    def drop_pending(self):
+        """Count the written value dropped because the current generation is
+        full"""
+        if not self.__pending_full:
+            collectd.warning('VES write queue is full, dropping new values')
+            self.__pending_full = True
+        self.__pending_dropped += 1
 
     def read(self, data=None):
-        """Collectd read callback. Use this callback to get host name"""
+        """Collectd read callback. Use this callback to get host name and
+        to dispatch the self-telemetry"""
+        if self.__plugin_config['SelfTelemetry']:
+            if len(self.__helpers):
+                # the helpers dispatch their telemetry, the write callback
+                # runs here as do the restarts of the helpers and the values
+                # lost while they were not running
+                self.dispatch_write_telemetry()
+                for helper in self.__helpers:
+                    helper.send(('read',))
+                    self.dispatch_value('derive', 'helper_restarts',
+                                        helper.counters['restarts'], helper.name)
+                    self.dispatch_value('derive', 'helper_values-dropped',
+                                        helper.counters['dropped'], helper.name)
+                return
+            self.dispatch_telemetry()
+            return
         vl = collectd.Values(type='gauge')
         vl.plugin='ves_plugin'
         vl.dispatch(values=[0])
 
-    def notify(self, n):
-        """Collectd notification callback"""
+    def dispatch_value(self, type_name, type_instance, value, plugin_instance=''):
+        """Dispatch a self-telemetry value"""
+        vl = collectd.Values(plugin='ves_plugin', plugin_instance=plugin_instance,
+                             type=type_name, type_instance=type_instance)
+        vl.dispatch(values=[value])
+
+    def dispatch_write_telemetry(self):
+        """Dispatch the self-telemetry values of the write callback"""
+        with self.__pending_lock:
+            count, latency, lock_wait = self.__write_stats
+            self.__write_stats = [0, 0.0, 0.0]
+        # average write callback latency and lock wait since the last read
+        self.dispatch_value('duration', 'write_latency',
+                            latency / count if count else 0.0)
+        self.dispatch_value('duration', 'write_lock_wait',
+                            lock_wait / count if count else 0.0)
+        self.dispatch_value('derive', 'values-dropped', self.__pending_dropped)
+
+    def dispatch_telemetry(self, writes=True):
+        """Dispatch the plugin self-telemetry values, those of the write
+        callback unless writes is False"""
+        if writes:
+            self.dispatch_write_telemetry()
+        build_time, tick_lock_wait = self.__tick_stats
+        self.dispatch_value('duration', 'event_build', build_time)
+        self.dispatch_value('duration', 'timer_lock_wait', tick_lock_wait)
+        self.dispatch_value('gauge', 'cache_entries', self.__cache_entries)
+        self.dispatch_value('gauge', 'cache_partitions', len(self.__partitions))
+        for reason in sorted(self.cache_evictions):
+            self.dispatch_value('derive', 'cache_evicted-' + reason,
+                                self.cache_evictions[reason])
+        if self.__ves_timer is not None:
+            self.dispatch_value('derive', 'timer_overruns', self.__ves_timer.overruns)
+        if self.__notifications is not None:
+            for name in sorted(self.__notifications.counters):
+                self.dispatch_value('derive', 'notifications-' + name,
+                                    self.__notifications.counters[name])
+        if len(self.__senders) == 0:
+            return
+        # the counters are summed over all senders and endpoints
+        self.dispatch_value('queue_length', 'events',
+                            sum(len(sender) for sender in self.__senders))
+        for name in sorted(self.__senders[0].counters):
+            self.dispatch_value('derive', 'events-' + name,
+                                sum(sender.counters[name] for sender in self.__senders))
+        for name in sorted(self.__endpoints[0].health.counters):
+            self.dispatch_value('derive', 'endpoint-' + name, sum(
+                endpoint.health.counters[name] for endpoint in self.__endpoints))
+        self.dispatch_value('total_bytes', 'sent',
+                            sum(endpoint.sent_bytes for endpoint in self.__endpoints))
+        # requests per send latency bucket, named by its upper bound in ms
+        for index in range(len(self.HTTP_LATENCY_BUCKETS) + 1):
+            requests = sum(endpoint.latency[index] for endpoint in self.__endpoints)
+            if index < len(self.HTTP_LATENCY_BUCKETS):
+                bucket = 'le_{}ms'.format(int(self.HTTP_LATENCY_BUCKETS[index] * 1000))
+            else:
+                bucket = 'gt_{}ms'.format(int(self.HTTP_LATENCY_BUCKETS[-1] * 1000))
+            self.dispatch_value('derive', 'http_latency-' + bucket, requests)
+
+    def get_fault_source(self, n):
+        """Get source of the fault event of the notification"""
+        if n.plugin == 'virt':
+            # if the notification is generated by virt plugin,
+            # use the plugin_instance (e.g. VM name) as a source.
+            return str(n.plugin_instance)
+        return self.get_hostname(n.host)
+
+    def make_fault(self, n):
+        """Make fault event of the notification"""
         collectd_event_severity_map = {
             collectd.NOTIF_FAILURE : 'CRITICAL',
             collectd.NOTIF_WARNING : 'WARNING',
@@ -896,16 +3091,10 @@ class VESPlugin(object):
         # fill out common header
         fault.event_type = "Notification"
         fault.functional_role = self.__plugin_config['FunctionalRole']
-        fault.reporting_entity_id = self.get_hostname()
-        fault.reporting_entity_name = self.get_hostname()
-        if n.plugin == 'virt':
-            # if the notification is generated by virt plugin,
-            # use the plugin_instance (e.g. VM name) as a source.
-            fault.source_id = str(n.plugin_instance)
-            fault.source_name = fault.source_id
-        else:
-            fault.source_id = self.get_hostname()
-            fault.source_name = self.get_hostname()
+        fault.reporting_entity_id = self.get_hostname(n.host)
+        fault.reporting_entity_name = fault.reporting_entity_id
+        fault.source_id = self.get_fault_source(n)
+        fault.source_name = fault.source_id
         fault.start_epoch_microsec = (n.time * 1000000)
         fault.last_epoch_micro_sec = fault.start_epoch_microsec
         # fill out fault header
@@ -914,20 +3103,120 @@ class VESPlugin(object):
         fault.alarm_interface_a = self.make_dash_string(n.plugin, n.plugin_instance)
         fault.event_source_type = 'host(3)'
         fault.alarm_condition = n.message
-        self.event_send(fault)
+        return fault
+
+    def notify(self, n):
+        """Collectd notification callback"""
+        if len(self.__helpers):
+            with self.__pending_lock:
+                self.__pending_notifications.append(n)
+            return
+        if self.__notifications is not None:
+            key = (n.host, n.plugin, n.plugin_instance, n.type_instance, n.severity)
+            if not self.__notifications.add(key, self.get_fault_source(n), n, time.time()):
+                return
+        self.event_send(self.make_fault(n))
+
+    def flush_notifications(self, limit=True):
+        """Send summary faults of the coalesced notifications: the last one
+        of each key with the number of notifications collapsed into it and
+        the times of the first and last of them"""
+        for n, repeats, first, last in self.__notifications.flush(time.time(), limit):
+            fault = self.make_fault(n)
+            fault.start_epoch_microsec = first * 1000000
+            fault.last_epoch_micro_sec = last * 1000000
+            fault.alarm_additional_information = [
+                Field('count', str(repeats)).get_obj()]
+            self.event_send(fault)
 
     def shutdown(self):
         """Collectd shutdown callback"""
-        # stop the timer
-        self.stop_timer()
-
-# The collectd plugin instance
-plugin_instance = VESPlugin()
-
-# Register plugin callbacks
-collectd.register_config(plugin_instance.config)
-collectd.register_init(plugin_instance.init)
-collectd.register_read(plugin_instance.read)
-collectd.register_write(plugin_instance.write)
-collectd.register_notification(plugin_instance.notify)
-collectd.register_shutdown(plugin_instance.shutdown)
+        if len(self.__helpers):
+            # the helpers wait up to 5 sec for their running tick and 5 sec
+            # to flush their events (see below), they are stopped at once
+            deadline = time.time() + 10.0
+            for helper in self.__helpers:
+                helper.stop(timeout=0)
+            for helper in self.__helpers:
+                helper.stop(timeout=max(deadline - time.time(), 0))
+            return
+        # stop the timers, the events of a running tick are queued before
+        # the senders are stopped
+        self.stop_timer(timeout=5.0)
+        # send the summaries of the coalesced notifications
+        if self.__notification_timer is not None:
+            self.__notification_timer.stop(timeout=5.0)
+            self.flush_notifications(limit=False)
+        # flush the queued events and stop the sender threads, they are
+        # stopped at once so the timeout is not multiplied by their number
+        deadline = time.time() + 5.0
+        for sender in self.__senders:
+            sender.stop(timeout=0)
+        for sender in self.__senders:
+            sender.stop(timeout=max(deadline - time.time(), 0))
+        # close the VES connections
+        for endpoint in self.__endpoints:
+            endpoint.pool.close()
+
+def helper_main():
+    """Run the helper process: read the messages of the plugin process from
+    stdin and pass them to the plugin instance of this process"""
+    global collectd
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    # nothing but the messages may be written to stdout
+    sys.stdout = sys.stderr
+    collectd = HelperCollectd(stdout)
+    plugin = VESPlugin()
+    initialized = False
+    while True:
+        try:
+            message = pickle.load(stdin)
+        except EOFError:
+            # the plugin process has exited
+            break
+        try:
+            if message[0] == 'values':
+                write = plugin.write
+                for vl in message[1]:
+                    write(HelperValues(*vl))
+            elif message[0] == 'notify':
+                for n in message[1]:
+                    plugin.notify(HelperNotification(*n))
+            elif message[0] == 'datasets':
+                collectd.datasets.update(message[1])
+            elif message[0] == 'host':
+                plugin.write(HelperValues(host=message[1], plugin='ves_plugin',
+                                          type='gauge', values=(0,)))
+            elif message[0] == 'read':
+                # the values are written to the helper by the forwarder, the
+                # write callback telemetry is dispatched by the plugin process
+                plugin.dispatch_telemetry(writes=False)
+            elif message[0] == 'config':
+                for name, value in message[2].items():
+                    setattr(collectd, name, value)
+                plugin.config(HelperConfig('Module', ['ves_plugin'], [
+                    HelperConfig(key, values) for key, values in message[1]]))
+                plugin.init()
+                initialized = True
+            elif message[0] == 'stop':
+                break
+        except Exception:
+            collectd.error('VES helper process error: {}'.format(traceback.format_exc()))
+    if initialized:
+        plugin.shutdown()
+
+if __name__ == '__main__':
+    # the helper process, see HelperProcess
+    helper_main()
+else:
+    # The collectd plugin instance
+    plugin_instance = VESPlugin()
+
+    # Register plugin callbacks
+    collectd.register_config(plugin_instance.config)
+    collectd.register_init(plugin_instance.init)
+    collectd.register_read(plugin_instance.read)
+    collectd.register_write(plugin_instance.write)
+    collectd.register_notification(plugin_instance.notify)
+    collectd.register_shutdown(plugin_instance.shutdown)